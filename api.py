@@ -1,6 +1,24 @@
+import asyncio
 import decouple
-import requests
-from db import TMDB_media_detail_clt
+import httpx
+import logging
+import time
+import unicodedata
+from urllib.parse import quote
+from cache import SingleFlight
+from resilience import CircuitBreaker, TokenBucket, backoff_delay
+from db import (
+    TMDB_media_detail_clt,
+    media_detail_clt,
+    trailers_clt,
+    search_results_clt,
+    cards_clt,
+    find_entry,
+    find_values,
+    save_value,
+    save_values,
+    delete_values,
+)
 
 
 TMBD_API_KEY = decouple.config("TMBD_API_KEY")
@@ -10,6 +28,19 @@ MOVIE_MEDIA_TYPE = "movie"
 TMDB_IMG_URL = r"https://image.tmdb.org/t/p/w500/"
 TMDB_MOVIE_PAGE = r"https://www.themoviedb.org/movie/"
 TMDB_TV_SERIES_PAGE = r"https://www.themoviedb.org/tv/"
+TMDB_MAX_CONCURRENCY = decouple.config("TMDB_MAX_CONCURRENCY", default=10, cast=int)
+logger = logging.getLogger(__name__)
+# Arabic variants of Persian characters, Persian and Arabic digits, tatweel and diacritics
+PERSIAN_CHARACTERS = str.maketrans({
+    "ي": "ی",
+    "ى": "ی",
+    "ك": "ک",
+    "ة": "ه",
+    "ـ": None,
+    **{chr(code): None for code in range(0x064B, 0x0653)},
+    **{chr(0x06F0 + digit): str(digit) for digit in range(10)},
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},
+})
 
 
 # TMBD API
@@ -22,28 +53,413 @@ TMDB_MOVIE_DETAIL = "https://api.themoviedb.org/3/movie/"
 TMDB_TV_SERIES_DETAIL = "https://api.themoviedb.org/3/tv/"
 
 
-def TMDB_search_by_phrase(phrase, language="en-US"):
+class TMDBUnavailableError(Exception):
+    """
+    Raised instead of sending a TMDB request while tmdb_circuit_breaker is open.
+    """
+
+
+# shared HTTP client, see init_http_client
+TMDB_HTTP_MAX_CONNECTIONS = decouple.config("TMDB_HTTP_MAX_CONNECTIONS", default=20, cast=int)
+TMDB_HTTP_MAX_KEEPALIVE_CONNECTIONS = decouple.config("TMDB_HTTP_MAX_KEEPALIVE_CONNECTIONS", default=10, cast=int)
+TMDB_HTTP_KEEPALIVE_EXPIRY = decouple.config("TMDB_HTTP_KEEPALIVE_EXPIRY", default=30.0, cast=float)
+TMDB_HTTP_TIMEOUT = decouple.config("TMDB_HTTP_TIMEOUT", default=10.0, cast=float)
+http_client = None
+# TMDB allows around 50 requests per second
+TMDB_RATE_LIMIT = decouple.config("TMDB_RATE_LIMIT", default=40, cast=float)
+TMDB_RATE_BURST = decouple.config("TMDB_RATE_BURST", default=40, cast=int)
+TMDB_MAX_RETRIES = decouple.config("TMDB_MAX_RETRIES", default=3, cast=int)
+TMDB_RETRY_BACKOFF = decouple.config("TMDB_RETRY_BACKOFF", default=0.5, cast=float)
+# a longer Retry-After is not waited for, the users would wait for it too
+TMDB_MAX_RETRY_AFTER = decouple.config("TMDB_MAX_RETRY_AFTER", default=30, cast=int)
+tmdb_rate_limiter = TokenBucket(TMDB_RATE_LIMIT, TMDB_RATE_BURST)
+TMDB_BREAKER_FAILURES = decouple.config("TMDB_BREAKER_FAILURES", default=5, cast=int)
+TMDB_BREAKER_SLOW_CALL = decouple.config("TMDB_BREAKER_SLOW_CALL", default=3.0, cast=float)
+TMDB_BREAKER_RESET = decouple.config("TMDB_BREAKER_RESET", default=30.0, cast=float)
+tmdb_circuit_breaker = CircuitBreaker(TMDB_BREAKER_FAILURES, TMDB_BREAKER_SLOW_CALL, TMDB_BREAKER_RESET)
+tmdb_stats = {
+    "requests": 0,
+    "throttled": 0,
+    "retried": 0,
+}
+# in-flight TMDB fetches by media key, see TMDB_fetch_media
+media_flight = SingleFlight()
+http_stats = {
+    "requests": 0,
+    "errors": 0,
+}
+
+
+def create_http_client():
+    """
+    Creates the pooled HTTP client used for every TMDB and image request.
+    HTTP/2 is enabled when the h2 package is installed.
+
+    Returns:
+        httpx.AsyncClient: The HTTP client.
+    """
+    try:
+        import h2  # noqa: F401
+        http2 = True
+    except ImportError:
+        http2 = False
+
+    async def count_response(response):
+        http_stats["requests"] += 1
+        if response.status_code >= 400:
+            http_stats["errors"] += 1
+
+    return httpx.AsyncClient(
+        http2=http2,
+        follow_redirects=True,
+        timeout=httpx.Timeout(TMDB_HTTP_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=TMDB_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=TMDB_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=TMDB_HTTP_KEEPALIVE_EXPIRY,
+        ),
+        event_hooks={"response": [count_response]},
+    )
+
+
+async def init_http_client():
+    """
+    Opens the shared HTTP client, called once when the application starts.
+    """
+    global http_client
+    if http_client is None or http_client.is_closed:
+        http_client = create_http_client()
+
+
+async def close_http_client():
+    """
+    Closes the shared HTTP client and its connections, called when the application stops.
+    """
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+
+
+def get_http_client():
+    """
+    Returns the shared HTTP client, it is created on first use if the application did not open it.
+
+    Returns:
+        httpx.AsyncClient: The HTTP client.
+    """
+    global http_client
+    if http_client is None or http_client.is_closed:
+        http_client = create_http_client()
+    return http_client
+
+
+def get_tmdb_stats():
+    """
+    Returns the statistics of the TMDB requests and of their rate limiter.
+
+    Returns:
+        dict: The number of sent, throttled and retried requests,
+            the rate limiter state and the circuit breaker state.
+    """
+    return {
+        **tmdb_stats,
+        "rate_limiter": tmdb_rate_limiter.stats(),
+        "circuit_breaker": tmdb_circuit_breaker.stats(),
+    }
+
+
+def get_http_pool_stats():
+    """
+    Returns the statistics of the shared HTTP client and its connection pool.
+
+    Returns:
+        dict: The number of requests, error responses and pooled connections.
+    """
+    stats = {
+        **http_stats,
+        "http2": False,
+        "connections": 0,
+        "idle_connections": 0,
+        "max_connections": TMDB_HTTP_MAX_CONNECTIONS,
+    }
+    if http_client is None:
+        return stats
+
+    # httpx does not expose its pool, so this reads the httpcore pool of the default transport
+    pool = getattr(http_client._transport, "_pool", None)
+    connections = getattr(pool, "connections", [])
+    stats["http2"] = getattr(pool, "_http2", False)
+    stats["connections"] = len(connections)
+    stats["idle_connections"] = len([conn for conn in connections if conn.is_idle()])
+    return stats
+
+
+async def TMDB_get(url):
+    """
+    Sends a GET request to the TMDB API without blocking the event loop.
+
+    The requests are rate limited by tmdb_rate_limiter. Throttled (429) requests,
+    server errors and connection errors are retried with a jittered exponential backoff,
+    honoring the Retry-After header of TMDB up to TMDB_MAX_RETRY_AFTER seconds.
+
+    Args:
+        url (str): The TMDB API url.
+
+    Returns:
+        httpx.Response: The response of the TMDB API, the failed response if the retries
+            are exhausted or TMDB asks to retry after more than TMDB_MAX_RETRY_AFTER seconds.
+
+    Raises:
+        TMDBUnavailableError: If tmdb_circuit_breaker is open.
+        httpx.TransportError: If the last retry could not connect to TMDB.
+    """
+    for attempt in range(TMDB_MAX_RETRIES + 1):
+        await tmdb_rate_limiter.acquire()
+        if not tmdb_circuit_breaker.allow():
+            raise TMDBUnavailableError(url)
+        tmdb_stats["requests"] += 1
+        started_at = time.monotonic()
+        try:
+            response = await get_http_client().get(url, headers=TMBD_HEADERS)
+        except httpx.TransportError:
+            tmdb_circuit_breaker.record_failure()
+            if attempt == TMDB_MAX_RETRIES:
+                raise
+            delay = backoff_delay(attempt, TMDB_RETRY_BACKOFF)
+        except BaseException:
+            # a cancelled request must not keep the trial of the half-open breaker forever
+            tmdb_circuit_breaker.release_trial()
+            raise
+        else:
+            if response.status_code == 429:
+                tmdb_stats["throttled"] += 1
+                # throttling is not an outage, TMDB answered
+                tmdb_circuit_breaker.record_success()
+            elif response.status_code < 500:
+                tmdb_circuit_breaker.record_success(time.monotonic() - started_at)
+                return response
+            else:
+                tmdb_circuit_breaker.record_failure()
+            if attempt == TMDB_MAX_RETRIES:
+                return response
+            delay = backoff_delay(attempt, TMDB_RETRY_BACKOFF)
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                if int(retry_after) > TMDB_MAX_RETRY_AFTER:
+                    return response
+                # a little jitter, so the throttled requests do not come back at once
+                delay = int(retry_after) + delay / 2
+
+        tmdb_stats["retried"] += 1
+        await asyncio.sleep(delay)
+
+
+async def download_image(url):
+    """
+    Downloads an image without blocking the event loop.
+
+    Args:
+        url (str): The image url.
+
+    Returns:
+        bytes: The content of the image, empty bytes if the download fails.
+    """
+    try:
+        response = await get_http_client().get(url)
+    except httpx.HTTPError:
+        return b""
+
+    if response.status_code == 200:
+        return response.content
+    return b""
+
+
+def TMDB_parse_credits(credits, limit_number=5):
+    """
+    Extracts the names of the casts, directors and writers from a TMDB credits payload.
+
+    Args:
+        credits (dict): The TMDB credits payload.
+        limit_number (int, optional): The maximum number of casts to retrieve.
+            Defaults to 5.
+
+    Returns:
+        dict: A dictionary containing the casts, directors, and writers.
+    """
+    casts_name = []
+    directors_name = []
+    writers_name = []
+
+    try:
+        casts = credits["cast"][:limit_number]
+        crew = credits["crew"]
+    except KeyError:
+        return {}
+
+    for cast in casts:
+        casts_name.append(cast["name"])
+
+    for item in crew:
+        if item["job"] == "Director":
+            directors_name.append(item["name"])
+        elif item["job"] == "Writer":
+            writers_name.append(item["name"])
+
+    return {"casts": casts_name,
+            "directors": directors_name,
+            "writers": writers_name}
+
+
+def TMDB_parse_additional_detail(response, credits, media_type):
+    """
+    Builds the additional details (genres, languages, credits, years) of a movie or TV series.
+
+    Args:
+        response (dict): The TMDB detail payload of the movie or TV series.
+        credits (dict): The parsed credits, see TMDB_parse_credits.
+        media_type (str): The media type ("movie" or "tv").
+
+    Returns:
+        dict: A dictionary containing additional details, empty if the payload is incomplete.
+    """
+    genres = []
+    languages = []
+    media_detail = {}
+
+    try:
+        # genres
+        for genre in response["genres"]:
+            genres.append(genre["name"])
+
+        # languages
+        for lang in response["spoken_languages"]:
+            languages.append(lang["english_name"])
+
+        media_detail["languages"] = languages
+        media_detail["genres"] = genres
+        media_detail["casts"] = credits["casts"]
+        media_detail["directors"] = credits["directors"]
+        media_detail["writers"] = credits["writers"]
+        # the dates and the IMDB ID are null for unreleased or unaired titles
+        if media_type == MOVIE_MEDIA_TYPE:
+            media_detail["imdb_id"] = response.get("imdb_id") or ""
+            media_detail["year"] = (response.get("release_date") or "")[:4]
+        elif media_type == TV_MEDIA_TYPE:
+            media_detail["year1"] = (response.get("first_air_date") or "")[:4]
+            media_detail["year2"] = (response.get("last_air_date") or "")[:4]
+    except (KeyError, TypeError):
+        return {}
+
+    return media_detail
+
+
+def TMDB_parse_trailers(videos, trailer_limit=1, language=None):
+    """
+    Sorts the videos of a movie or TV series, trailers first.
+
+    Args:
+        videos (dict): The TMDB videos payload.
+        trailer_limit (int, optional): The maximum number of trailers to retrieve.
+            Defaults to 1.
+        language (str, optional): If given, only the videos in this language are kept,
+            unless there is none of them.
+
+    Returns:
+        list: A list of dictionaries containing information about the trailers.
+    """
+    youtube_url = "https://www.youtube.com/watch?v="
+    official_trailers = []
+    non_official_trailers = []
+    other_results = []
+
+    items = videos.get("results", [])
+    if language:
+        # prefer the videos in the requested language, fall back to the others
+        items = [item for item in items if item.get("iso_639_1") == language[:2]] or items
+
+    for item in items:
+        temp = {
+            "name": item['name'],
+            "official": item['official'],
+            "type": item["type"],
+        }
+        if item["type"] == "Trailer":
+            if item["site"] == "YouTube" and item["key"]:
+                temp["url"] = youtube_url + item["key"]
+            if item['official']:
+                official_trailers.append(temp)
+            else:
+                non_official_trailers.append(temp)
+        else:
+            if item["site"] == "YouTube" and item["key"]:
+                temp["url"] = youtube_url + item["key"]
+            other_results.append(temp)
+
+    results = [*official_trailers, *non_official_trailers, *other_results]
+
+    if trailer_limit > len(results):
+        trailer_limit = len(results)
+    return results[:trailer_limit]
+
+
+def normalize_phrase(phrase):
+    """
+    Normalizes a search phrase, so the same search typed in different ways shares a cache entry.
+    Case, extra whitespace, Arabic variants of Persian characters, diacritics and digits are unified.
+
+    Args:
+        phrase (str): The search phrase.
+
+    Returns:
+        str: The normalized phrase.
+    """
+    phrase = unicodedata.normalize("NFKC", phrase).casefold()
+    phrase = phrase.translate(PERSIAN_CHARACTERS)
+    return " ".join(phrase.split())
+
+
+async def TMDB_search_by_phrase(phrase, language="en-US", page=1):
     """
     Searches for movies or TV series based on a given phrase and language.
 
+    The results are cached by the normalized phrase and the language, see normalize_phrase.
+    Expired results are still returned if TMDB can not be reached. The returned dictionary
+    is shared with the cache and must not be modified.
+
     Args:
         phrase (str): The search phrase.
         language (str): The language you want to see the answer in
+        page (int, optional): The page of the search results. Defaults to 1.
 
     Returns:
         dict or str: A dictionary containing search results if successful,
             otherwise returns 'error'.
     """
-    url = f"https://api.themoviedb.org/3/search/multi?query={phrase}&language={language}"
-    response = requests.get(url, headers=TMBD_HEADERS)
+    phrase = normalize_phrase(phrase)
+    key = f"search---{language}---{page}---{phrase}"
+    cached, stale = await find_entry(search_results_clt, key)
+    if cached is not None and not stale:
+        return cached
+
+    url = f"https://api.themoviedb.org/3/search/multi?query={quote(phrase)}&language={language}&page={page}"
+    try:
+        response = await TMDB_get(url)
+    except (TMDBUnavailableError, httpx.HTTPError):
+        if cached is not None:
+            return cached
+        raise
 
     if response.status_code == 200:
+        await save_value(search_results_clt, key, response.json())
         return response.json()
+    elif cached is not None:
+        return cached
     else:
         return "error"
 
 
-def TMDB_get_movie_detail(movie_id, language="en-us"):
+async def TMDB_get_movie_detail(movie_id, language="en-us"):
     """
     Retrieves detailed information about a movie.
 
@@ -56,7 +472,7 @@ def TMDB_get_movie_detail(movie_id, language="en-us"):
             otherwise returns 'error'.
     """
     url = f"https://api.themoviedb.org/3/movie/{movie_id}?language={language}"
-    response = requests.get(url, headers=TMBD_HEADERS)
+    response = await TMDB_get(url)
 
     if response.status_code == 200:
         return response.json()
@@ -64,7 +480,7 @@ def TMDB_get_movie_detail(movie_id, language="en-us"):
         return "error"
 
 
-def TMDB_get_movie_credits_name(movie_id, limit_number=5, language="en-US"):
+async def TMDB_get_movie_credits_name(movie_id, limit_number=5, language="en-US"):
     """
     Retrieves the credits (cast, directors, writers) for a movie.
 
@@ -78,35 +494,14 @@ def TMDB_get_movie_credits_name(movie_id, limit_number=5, language="en-US"):
         dict: A dictionary containing the casts, directors, and writers for the movie.
     """
     url = f"https://api.themoviedb.org/3/movie/{movie_id}/credits?language={language}"
-    response = requests.get(url, headers=TMBD_HEADERS)
-    casts_name = []
-    directors_name = []
-    writers_name = []
+    response = await TMDB_get(url)
 
     if response.status_code != 200:
         return {}
-    try:
-        if limit_number > len(response.json()["cast"]):
-            limit_number = len(response.json()["cast"])
-    except KeyError:
-        return {}
+    return TMDB_parse_credits(response.json(), limit_number)
 
-    casts = response.json()["cast"][:limit_number]
-    for cast in casts:
-        casts_name.append(cast["name"])
 
-    for item in response.json()["crew"]:
-        if item["job"] == "Director":
-            directors_name.append(item["name"])
-        elif item["job"] == "Writer":
-            writers_name.append(item["name"])
-
-    return {"casts": casts_name,
-            "directors": directors_name,
-            "writers": writers_name}
-
-
-def TMDB_get_movie_additional_detail(movie_id, cast_limit=5, detail=False, language="en-US"):
+async def TMDB_get_movie_additional_detail(movie_id, cast_limit=5, detail=False, language="en-US"):
     """
     Retrieves additional details about a movie, including genres, languages, and credits.
 
@@ -121,41 +516,21 @@ def TMDB_get_movie_additional_detail(movie_id, cast_limit=5, detail=False, langu
     Returns:
         dict: A dictionary containing additional details about the movie.
     """
-    genres = []
-    languages = []
-    movie_detail = {}
-
-    response = TMDB_get_movie_detail(movie_id, language)
+    response = await TMDB_get_movie_detail(movie_id, language)
     if response == "error":
         return {}
 
-    credits = TMDB_get_movie_credits_name(movie_id, cast_limit, language)
-
-    try:
-        # genres
-        for genre in response["genres"]:
-            genres.append(genre["name"])
-
-        # languages
-        for lang in response["spoken_languages"]:
-            languages.append(lang["english_name"])
-
-        movie_detail["imdb_id"] = response["imdb_id"]
-        movie_detail["languages"] = languages
-        movie_detail["genres"] = genres
-        movie_detail["casts"] = credits["casts"]
-        movie_detail["directors"] = credits["directors"]
-        movie_detail["writers"] = credits["writers"]
-        movie_detail["year"] = response["release_date"][:4]
+    credits = await TMDB_get_movie_credits_name(movie_id, cast_limit, language)
 
-    except KeyError:
+    movie_detail = TMDB_parse_additional_detail(response, credits, MOVIE_MEDIA_TYPE)
+    if not movie_detail:
         return {}
     if detail:
         return {**response, **movie_detail}
     return movie_detail
 
 
-def TMDB_get_tv_series_detail(series_id, language="en-US"):
+async def TMDB_get_tv_series_detail(series_id, language="en-US"):
     """
     Retrieves detailed information about a TV series.
 
@@ -168,7 +543,7 @@ def TMDB_get_tv_series_detail(series_id, language="en-US"):
             otherwise returns 'error'.
     """
     url = f"https://api.themoviedb.org/3/tv/{series_id}?language={language}"
-    response = requests.get(url, headers=TMBD_HEADERS)
+    response = await TMDB_get(url)
 
     if response.status_code == 200:
         return response.json()
@@ -176,7 +551,7 @@ def TMDB_get_tv_series_detail(series_id, language="en-US"):
         return "error"
 
 
-def TMDB_get_tv_series_credits_names(series_id, limit_number=5, language="en-US"):
+async def TMDB_get_tv_series_credits_names(series_id, limit_number=5, language="en-US"):
     """
     Retrieves the credits (cast, directors, writers) for a TV series.
 
@@ -190,35 +565,14 @@ def TMDB_get_tv_series_credits_names(series_id, limit_number=5, language="en-US"
         dict: A dictionary containing the casts, directors, and writers for the TV series.
     """
     url = f"https://api.themoviedb.org/3/tv/{series_id}/credits?language={language}"
-    response = requests.get(url, headers=TMBD_HEADERS)
-    casts_name = []
-    directors_name = []
-    writers_name = []
+    response = await TMDB_get(url)
 
     if response.status_code != 200:
         return {}
-    try:
-        if limit_number > len(response.json()["cast"]):
-            limit_number = len(response.json()["cast"])
-    except KeyError:
-        return {}
-
-    casts = response.json()["cast"][:limit_number]
-    for cast in casts:
-        casts_name.append(cast["name"])
-
-    for item in response.json()["crew"]:
-        if item["job"] == "Director":
-            directors_name.append(item["name"])
-        elif item["job"] == "Writer":
-            writers_name.append(item["name"])
-
-    return {"casts": casts_name,
-            "directors": directors_name,
-            "writers": writers_name}
+    return TMDB_parse_credits(response.json(), limit_number)
 
 
-def TMDB_get_tv_series_additional_detail(series_id, cast_limit=5, detail=False, language="en-us"):
+async def TMDB_get_tv_series_additional_detail(series_id, cast_limit=5, detail=False, language="en-us"):
     """
     Retrieves additional details about a TV series, including genres, languages, and credits.
 
@@ -233,41 +587,21 @@ def TMDB_get_tv_series_additional_detail(series_id, cast_limit=5, detail=False,
     Returns:
         dict: A dictionary containing additional details about the TV series.
     """
-    genres = []
-    languages = []
-    series_detail = {}
-
-    response = TMDB_get_tv_series_detail(series_id, language)
+    response = await TMDB_get_tv_series_detail(series_id, language)
     if response == "error":
         return {}
 
-    credits = TMDB_get_tv_series_credits_names(series_id, cast_limit, language)
-
-    try:
-        # genres
-        for genre in response["genres"]:
-            genres.append(genre["name"])
-
-        # languages
-        for lang in response["spoken_languages"]:
-            languages.append(lang["english_name"])
+    credits = await TMDB_get_tv_series_credits_names(series_id, cast_limit, language)
 
-        series_detail["languages"] = languages
-        series_detail["genres"] = genres
-        series_detail["casts"] = credits["casts"]
-        series_detail["directors"] = credits["directors"]
-        series_detail["writers"] = credits["writers"]
-        series_detail["year1"] = response["first_air_date"][:4]
-        series_detail["year2"] = response["last_air_date"][:4]
-
-    except KeyError:
+    series_detail = TMDB_parse_additional_detail(response, credits, TV_MEDIA_TYPE)
+    if not series_detail:
         return {}
     if detail:
         return {**response, **series_detail}
     return series_detail
 
 
-def TMDB_get_trailer(ids, media_type, trailer_limit=1, language="en-US"):
+async def TMDB_get_trailer(ids, media_type, trailer_limit=1, language="en-US"):
     """
     Retrieves trailers for a movie or TV series.
 
@@ -279,46 +613,159 @@ def TMDB_get_trailer(ids, media_type, trailer_limit=1, language="en-US"):
         language (str): The language you want to see the answer in
 
     Returns:
-        list: A list of dictionaries containing information about the trailers.
+        list or None: A list of dictionaries containing information about the trailers,
+            None if the request fails, so the failure is not cached as a media without trailers.
     """
-    youtube_url = "https://www.youtube.com/watch?v="
-    official_trailers = []
-    non_official_trailers = []
-    other_results = []
     if media_type == MOVIE_MEDIA_TYPE:
         url = f"https://api.themoviedb.org/3/movie/{ids}/videos?language={language}"
     elif media_type == TV_MEDIA_TYPE:
         url = f"https://api.themoviedb.org/3/tv/{ids}/videos?language={language}"
-    response = requests.get(url, headers=TMBD_HEADERS)
+    # videos in English are used when there is no video in the user language
+    url += f"&include_video_language={language[:2]},en"
+    response = await TMDB_get(url)
     if response.status_code != 200:
-        return official_trailers
+        return None
 
-    for item in response.json()['results']:
-        temp = {
-            "name": item['name'],
-            "official": item['official'],
-            "type": item["type"],
-        }
-        if item["type"] == "Trailer":
-            if item["site"] == "YouTube" and item["key"]:
-                temp["url"] = youtube_url + item["key"]
-            if item['official']:
-                official_trailers.append(temp)
-            else:
-                non_official_trailers.append(temp)
-        else:
-            if item["site"] == "YouTube" and item["key"]:
-                temp["url"] = youtube_url + item["key"]
-            other_results.append(temp)
+    return TMDB_parse_trailers(response.json(), trailer_limit, language)
 
-    results = [*official_trailers, *non_official_trailers, *other_results]
 
-    if trailer_limit > len(results):
-        trailer_limit = len(results)
-    return results[:trailer_limit]
+async def TMDB_get_media_full_detail(ids, media_type, cast_limit=5, trailer_limit=1, language="en-US"):
+    """
+    Retrieves the details, credits and trailers of a movie or TV series in one request
+    by using the TMDB append_to_response parameter.
+
+    Args:
+        ids (int): The ID of the movie or TV series.
+        media_type (str): The media type ("movie" or "tv").
+        cast_limit (int, optional): The maximum number of credits to retrieve.
+            Defaults to 5.
+        trailer_limit (int, optional): The maximum number of trailers to retrieve.
+            Defaults to 1.
+        language (str): The language you want to see the answer in
 
+    Returns:
+        tuple: The full details, the additional details and the trailers of the media,
+            empty if TMDB has no such media.
 
-def TMDB_search_response_bot(phrase, language="en-US"):
+    Raises:
+        TMDBUnavailableError: If TMDB still throttles the request or fails after the retries.
+    """
+    if media_type == MOVIE_MEDIA_TYPE:
+        url = TMDB_MOVIE_DETAIL
+    elif media_type == TV_MEDIA_TYPE:
+        url = TMDB_TV_SERIES_DETAIL
+    else:
+        return {}, {}, []
+    # videos in English are appended too, they are used when there is no video in the user language
+    url += (f"{ids}?language={language}&append_to_response=credits,videos"
+            f"&include_video_language={language[:2]},en")
+    response = await TMDB_get(url)
+    if response.status_code == 429 or response.status_code >= 500:
+        raise TMDBUnavailableError(url)
+    if response.status_code != 200:
+        return {}, {}, []
+
+    response = response.json()
+    credits = TMDB_parse_credits(response.pop("credits", {}), cast_limit)
+    trailers = TMDB_parse_trailers(response.pop("videos", {}), trailer_limit, language)
+    additional_detail = TMDB_parse_additional_detail(response, credits, media_type)
+    if not additional_detail:
+        return {}, {}, trailers
+
+    return {**response, **additional_detail}, additional_detail, trailers
+
+
+async def TMDB_fetch_and_cache_media(ids, media_type, language="en-US"):
+    """
+    Fetches a movie or TV series from TMDB with one request and stores it
+    in the media_detail, TMDB_media_detail and trailers caches.
+
+    Args:
+        ids (int): The ID of the movie or TV series.
+        media_type (str): The media type ("movie" or "tv").
+        language (str): The language you want to see the answer in
+
+    Returns:
+        tuple: The full details, the additional details and the trailers of the media,
+            empty and not stored if TMDB has no such media or its details are malformed.
+
+    Raises:
+        TMDBUnavailableError, httpx.HTTPError: If TMDB is unavailable, nothing is stored.
+    """
+    item, additional_detail, trailers = await TMDB_get_media_full_detail(ids, media_type, language=language)
+    if not item:
+        # keep the cached values, they are better than nothing
+        return item, additional_detail, trailers
+
+    # a new version of the details, the rendered captions of older versions are not used
+    cache_version = time.time_ns()
+    item = {**item, "cache_version": cache_version}
+    additional_detail = {**additional_detail, "cache_version": cache_version}
+
+    await save_value(media_detail_clt, f"{media_type}---{ids}---{language}", item)
+    await save_value(TMDB_media_detail_clt, f"TMDB---{media_type}---{ids}---{language}", additional_detail)
+    await save_value(trailers_clt, f"trailers---{media_type}---{ids}---{language}", trailers)
+    await invalidate_cards([(media_type, ids)], language)
+
+    return item, additional_detail, trailers
+
+
+async def invalidate_cards(medias, language="en-US"):
+    """
+    Removes the rendered detail cards of movies or TV series whose details or trailers
+    were stored again, so they are rendered from the new values.
+
+    Args:
+        medias (list): The (media_type, id) of each movie or TV series.
+        language (str): The language of the cards.
+    """
+    await delete_values(cards_clt, [f"card---{media_type}---{ids}---{language}" for media_type, ids in medias])
+
+
+async def TMDB_fetch_media(ids, media_type, language="en-US"):
+    """
+    Fetches a movie or TV series from TMDB and stores it in the caches,
+    see TMDB_fetch_and_cache_media. Concurrent fetches of the same media
+    share one TMDB request.
+
+    Args:
+        ids (int): The ID of the movie or TV series.
+        media_type (str): The media type ("movie" or "tv").
+        language (str): The language you want to see the answer in
+
+    Returns:
+        tuple: The full details, the additional details and the trailers of the media.
+
+    Raises:
+        TMDBUnavailableError, httpx.HTTPError: If TMDB is unavailable.
+    """
+    key = f"{media_type}---{ids}---{language}"
+    return await media_flight.do(key, TMDB_fetch_and_cache_media, ids, media_type, language)
+
+
+def TMDB_refresh_media(ids, media_type, language="en-US"):
+    """
+    Refreshes the cached values of a stale movie or TV series in a background task,
+    so the stale values can be served without waiting for TMDB.
+
+    Args:
+        ids (int): The ID of the movie or TV series.
+        media_type (str): The media type ("movie" or "tv").
+        language (str): The language you want to see the answer in
+    """
+    if tmdb_circuit_breaker.state == CircuitBreaker.OPEN:
+        return
+    key = f"{media_type}---{ids}---{language}"
+
+    def done(task):
+        if not task.cancelled() and task.exception():
+            logger.warning("Refreshing %s failed: %r", key, task.exception())
+
+    task = media_flight.start(key, TMDB_fetch_and_cache_media, ids, media_type, language)
+    task.add_done_callback(done)
+
+
+async def TMDB_search_response_bot(phrase, language="en-US"):
     """
     Searches for movies or TV series based on a given phrase and retrieves additional details.
 
@@ -328,36 +775,173 @@ def TMDB_search_response_bot(phrase, language="en-US"):
 
 Returns:
         dict or str: A dictionary containing search results with additional details if successful,
-            otherwise returns empty list.
+            otherwise returns empty list. Results whose details could not be retrieved are left out.
+
+    Raises:
+        TMDBUnavailableError: If TMDB can not be reached and nothing is cached for the phrase,
+            or none of its results is cached and TMDB could not be reached for some of them,
+            so "not found" is not answered during an outage.
     """
-    response = TMDB_search_by_phrase(phrase, language)
-    if response != "error":
-        try:
-            if response and response["results"]:
-                for item in response["results"]:
-                    if item["media_type"] == MOVIE_MEDIA_TYPE:
-                        movie_id = item["id"]
-                        movie = TMDB_media_detail_clt.find_one({"key": f"TMDB---{MOVIE_MEDIA_TYPE}---{movie_id}---{language}"})
-                        if not movie:
-                            movie = TMDB_get_movie_additional_detail(movie_id, language=language)
-                            TMDB_media_detail_clt.insert_one({"key": f"TMDB---{MOVIE_MEDIA_TYPE}---{movie_id}---{language}",
-                                                              "value": movie,})
-                        else:
-                            movie = movie.get('value')
-                        item.update(movie)
-                    elif item["media_type"] == TV_MEDIA_TYPE:
-                        series_id = item["id"]
-                        series = TMDB_media_detail_clt.find_one({"key": f"TMDB---{TV_MEDIA_TYPE}---{series_id}---{language}"})
-                        if not series:
-                            series = TMDB_get_tv_series_additional_detail(series_id, language=language)
-                            TMDB_media_detail_clt.insert_one({"key": f"TMDB---{TV_MEDIA_TYPE}---{series_id}---{language}",
-                                                              "value": series,})
-                        else:
-                            series = series.get('value')
-                        item.update(series)
-        except KeyError:
-            return []
-    else:
+    try:
+        response = await TMDB_search_by_phrase(phrase, language)
+    except (TMDBUnavailableError, httpx.HTTPError) as error:
+        raise TMDBUnavailableError(phrase) from error
+    if response == "error":
         return []
 
-    return response["results"]
+    try:
+        results = response["results"]
+        # the enrichment stage fetches every missing item concurrently,
+        # bounded by TMDB_MAX_CONCURRENCY
+        semaphore = asyncio.Semaphore(TMDB_MAX_CONCURRENCY)
+        unavailable = []
+
+        async def enrich(item):
+            media_type = item["media_type"]
+            if media_type not in (MOVIE_MEDIA_TYPE, TV_MEDIA_TYPE):
+                return None
+            key = f"TMDB---{media_type}---{item['id']}---{language}"
+            media, stale = await find_entry(TMDB_media_detail_clt, key)
+            if media is None:
+                async with semaphore:
+                    try:
+                        # warms the detail and trailers caches of the item too
+                        _, media, _ = await TMDB_fetch_media(item["id"], media_type, language)
+                    except (TMDBUnavailableError, httpx.HTTPError):
+                        unavailable.append(item["id"])
+                        return None
+            elif stale:
+                TMDB_refresh_media(item["id"], media_type, language)
+            if not media:
+                return None
+            # the search results are cached, so they are copied instead of updated
+            return {**item, **media}
+
+        results = await asyncio.gather(*(enrich(item) for item in results))
+    except KeyError:
+        return []
+
+    # while TMDB is unavailable only the cached items can be shown
+    results = [item for item in results if item]
+    if unavailable and not results:
+        # the movies or TV series found could not be fetched because of the outage,
+        # the ones TMDB has no valid details of are left out as not found
+        raise TMDBUnavailableError(phrase)
+    return results
+
+
+async def TMDB_search_response_lite(phrase, language="en-US", page=1):
+    """
+    Searches for movies or TV series based on a given phrase without retrieving additional details,
+    so it costs at most one TMDB request. The year is derived from the release or air date,
+    the other additional details are left empty.
+
+    Args:
+        phrase (str): The search phrase.
+        language (str): The language you want to see the answer in
+        page (int, optional): The page of the search results. Defaults to 1.
+
+    Returns:
+        dict: The movies and TV series of the search results page, with the page number
+            and the total number of pages and results, empty if the search fails.
+    """
+    response = {"page": page, "results": [], "total_pages": 0, "total_results": 0}
+    try:
+        search = await TMDB_search_by_phrase(phrase, language, page)
+    except (TMDBUnavailableError, httpx.HTTPError):
+        return response
+    if search == "error":
+        return response
+
+    response["total_pages"] = search.get("total_pages", 0)
+    response["total_results"] = search.get("total_results", 0)
+    for item in search.get("results", []):
+        if item.get("media_type") == MOVIE_MEDIA_TYPE:
+            response["results"].append({**item,
+                                        "imdb_id": None,
+                                        "year": (item.get("release_date") or "")[:4]})
+        elif item.get("media_type") == TV_MEDIA_TYPE:
+            response["results"].append({**item,
+                                        "year1": (item.get("first_air_date") or "")[:4],
+                                        "year2": ""})
+    return response
+
+
+async def TMDB_get_trailers_bulk(items, language="en-US"):
+    """
+    Retrieves the trailers of several movies or TV series with one cache query,
+    fetches the missing ones from TMDB concurrently and stores them with one bulk write.
+
+    Args:
+        items (list): The movies or TV series, dictionaries with "media_type" and "id".
+        language (str): The language you want to see the answer in
+
+    Returns:
+        dict: The trailers by (media_type, id).
+    """
+    keys = {(item["media_type"], item["id"]): f"trailers---{item['media_type']}---{item['id']}---{language}"
+            for item in items}
+    cached = await find_values(trailers_clt, list(keys.values()))
+    trailers = {}
+    for media, key in keys.items():
+        if key not in cached:
+            continue
+        trailers[media], stale = cached[key]
+        if stale:
+            # stale-while-revalidate
+            TMDB_refresh_media(media[1], media[0], language)
+
+    missing = [media for media in keys if media not in trailers]
+    semaphore = asyncio.Semaphore(TMDB_MAX_CONCURRENCY)
+
+    async def fetch(media_type, ids):
+        async with semaphore:
+            try:
+                return await TMDB_get_trailer(ids, media_type, language=language)
+            except (TMDBUnavailableError, httpx.HTTPError):
+                return None
+
+    fetched = await asyncio.gather(*(fetch(media_type, ids) for media_type, ids in missing))
+    new_trailers = {}
+    for media, media_trailers in zip(missing, fetched):
+        # a failed fetch is not stored, so it is retried next time
+        if media_trailers is not None:
+            trailers[media] = media_trailers
+            new_trailers[keys[media]] = media_trailers
+    await save_values(trailers_clt, new_trailers)
+    await invalidate_cards([media for media in missing if keys[media] in new_trailers], language)
+
+    return trailers
+
+
+async def TMDB_get_media(ids, media_type, language="en-US"):
+    """
+    Retrieves the full details and the trailers of a movie or TV series from the caches,
+    and fetches them from TMDB with one request if any of them is missing.
+    Stale values are returned at once and refreshed in the background.
+
+    Args:
+        ids (int): The ID of the movie or TV series.
+        media_type (str): The media type ("movie" or "tv").
+        language (str): The language you want to see the answer in
+
+    Returns:
+        tuple: The full details and the trailers of the media,
+            the details are empty if they are not cached and TMDB is unavailable.
+    """
+    item, item_stale = await find_entry(media_detail_clt, f"{media_type}---{ids}---{language}")
+    trailers, trailers_stale = await find_entry(trailers_clt, f"trailers---{media_type}---{ids}---{language}")
+    if not item or trailers is None:
+        try:
+            fetched_item, _, fetched_trailers = await TMDB_fetch_media(ids, media_type, language)
+        except (TMDBUnavailableError, httpx.HTTPError):
+            fetched_item, fetched_trailers = {}, []
+        if fetched_item:
+            item, trailers = fetched_item, fetched_trailers
+        # while TMDB is unavailable whatever is cached is returned
+        item, trailers = item or {}, trailers or []
+    elif item_stale or trailers_stale:
+        # stale-while-revalidate
+        TMDB_refresh_media(ids, media_type, language)
+
+    return item, trailers
@@ -0,0 +1,126 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    A bounded in-memory cache, the least recently used entries are evicted
+    when it is full and every entry expires after ttl seconds.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        """
+        Args:
+            maxsize (int, optional): The maximum number of entries. Defaults to 1024.
+            ttl (float, optional): The lifetime of an entry in seconds. Defaults to 3600.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """
+        Returns the value of a key, or default if it is missing or expired.
+        """
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self._data.pop(key, None)
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value):
+        """
+        Stores the value of a key and evicts the least recently used entries if the cache is full.
+        """
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key):
+        """
+        Removes a key from the cache if it exists.
+        """
+        self._data.pop(key, None)
+
+    def clear(self):
+        """
+        Removes every entry of the cache.
+        """
+        self._data.clear()
+
+    def stats(self):
+        """
+        Returns the size and the hit/miss counters of the cache.
+
+        Returns:
+            dict: The statistics of the cache.
+        """
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key, so they share the result of one in-flight call.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared_calls = 0
+        self._futures = {}
+
+    def start(self, key, func, *args, **kwargs):
+        """
+        Starts func(*args, **kwargs) as a task, unless a call with the same key is in flight.
+
+        Returns:
+            asyncio.Future: The future of the in-flight call.
+        """
+        future = self._futures.get(key)
+        if future is not None:
+            self.shared_calls += 1
+            return future
+
+        self.calls += 1
+        future = asyncio.ensure_future(func(*args, **kwargs))
+        self._futures[key] = future
+        future.add_done_callback(lambda _: self._futures.pop(key, None))
+        return future
+
+    async def do(self, key, func, *args, **kwargs):
+        """
+        Awaits the in-flight call with the same key, or starts a new one, see start.
+
+        Returns:
+            The result of the call.
+        """
+        # a cancelled caller must not cancel the call shared with the others
+        return await asyncio.shield(self.start(key, func, *args, **kwargs))
+
+    def stats(self):
+        """
+        Returns the number of started and shared calls.
+
+        Returns:
+            dict: The statistics of the single-flight.
+        """
+        return {
+            "in_flight": len(self._futures),
+            "calls": self.calls,
+            "shared_calls": self.shared_calls,
+        }
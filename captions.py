@@ -0,0 +1,395 @@
+import asyncio
+import decouple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from api import TMDB_IMG_URL, MOVIE_MEDIA_TYPE, TV_MEDIA_TYPE
+from cache import TTLCache
+from db import CACHE_MAXSIZE, CACHE_TTL
+
+
+ENG_LANG = "en-US"
+FA_LANG = "fa-IR"
+# "none" renders the captions on the event loop, "thread" or "process" in a pool of workers
+CAPTION_RENDER_POOL = decouple.config('CAPTION_RENDER_POOL', default="none")
+CAPTION_RENDER_WORKERS = decouple.config('CAPTION_RENDER_WORKERS', default=2, cast=int)
+IMDB_TITLE_URL = "https://www.imdb.com/title/"
+# the kinds of payloads the captions are rendered from, they render differently,
+# e.g. the search results of TV series have no last air date
+DETAIL_CAPTION = "detail"
+LIST_CAPTION = "list"
+
+movie_and_tv_detail_lang = {
+    "movie": {
+        ENG_LANG: "Movie",
+        FA_LANG: "فیلم",
+    },
+    "tv_series": {
+        ENG_LANG: "Tv Series",
+        FA_LANG: "سریال تلوزیونی",
+    },
+    "user_ratings": {
+        ENG_LANG: "Usᴇʀ Rᴀᴛɪɴɢs",
+        FA_LANG: "امتیاز کاربران",
+    },
+    "imdb_id": {
+        ENG_LANG: "𝙸ᴍᴅʙ 𝙸ᴅ",
+        FA_LANG: "آیدی آی‌ام‌دی‌بی",
+    },
+    "type": {
+        ENG_LANG: "Type",
+        FA_LANG: "نوع",
+    },
+    "released_date": {
+        ENG_LANG: "Rᴇʟᴇᴀsᴇ Dᴀᴛᴇ",
+        FA_LANG: "تاریخ انتشار",
+    },
+    "language": {
+        ENG_LANG: "Lᴀɴɢᴜᴀɢᴇ",
+        FA_LANG: "زبان",
+    },
+    "genre": {
+        ENG_LANG: "Gᴇɴʀᴇ",
+        FA_LANG: "ژانر",
+    },
+    "story_line": {
+        ENG_LANG: "Sᴛᴏʀy Lɪɴᴇ",
+        FA_LANG: "خلاصه داستان",
+    },
+    "director": {
+        ENG_LANG: "Dɪʀᴇᴄᴛᴏʀ",
+        FA_LANG: "کارگردان",
+    },
+    "writer": {
+        ENG_LANG: "Wʀɪᴛᴇʀ",
+        FA_LANG: "نویسنده",
+    },
+    "actors": {
+        ENG_LANG: "Aᴄᴛᴏʀs",
+        FA_LANG: "بازیگران",
+    },
+    "air_date": {
+        ENG_LANG: "Air Dᴀᴛᴇ",
+        FA_LANG: "تاریخ پخش",
+    },
+    "season": {
+        ENG_LANG: "Season",
+        FA_LANG: "فصل",
+    },
+    "episode": {
+        ENG_LANG: "Episode",
+        FA_LANG: "قسمت",
+    },
+    "official_trailer": {
+        ENG_LANG: "Official trailer",
+        FA_LANG: "تریلر رسمی",
+    },
+    "non_official_trailer": {
+        ENG_LANG: "Non official trailer",
+        FA_LANG: "تریلر غیر رسمی",
+    },
+    "list_trailers": {
+        ENG_LANG: "🎬 Trailers of the results above",
+        FA_LANG: "🎬 تریلرهای نتایج بالا",
+    },
+    "unavailable": {
+        ENG_LANG: "Sorry. We can not get the details right now. Please try again later!",
+        FA_LANG: "متاسفیم. در حال حاضر نمی‌توانیم جزئیات را دریافت کنیم. لطفا بعدا تلاش کنید!",
+    },
+}
+
+# the parts of the captions which are not a label of movie_and_tv_detail_lang
+RATINGS_TEXT = {
+    ENG_LANG: "{vote_average:.1f} / 10  <code>({vote_average:.1f} based on {vote_count} user ratings)</code>",
+    FA_LANG: "10 / {vote_average:.1f}  <code>({vote_average:.1f} بر اساس امتیاز {vote_count} کاربر)</code>",
+}
+AIR_DATE_RANGE_TEXT = {
+    ENG_LANG: "{first_air_date} to {last_air_date}",
+    FA_LANG: "{first_air_date} تا {last_air_date}",
+}
+
+# the rendered captions, see get_caption
+caption_cache = TTLCache(CACHE_MAXSIZE, CACHE_TTL)
+render_pool = None
+
+
+def escape_braces(text: str) -> str:
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+def compile_layout(media_type: str, language: str) -> dict:
+    """
+    Build the format strings of the caption lines of a media type in a language,
+    with the labels of movie_and_tv_detail_lang already in them.
+
+    Args:
+        media_type (str): The type of media (movie or TV series).
+        language (str): The language of the caption.
+
+    Returns:
+        dict: The format string of each caption line.
+    """
+    label = {name: escape_braces(texts[language]) for name, texts in movie_and_tv_detail_lang.items()}
+    shared = {
+        "language": f"💬 {label['language']}: {{languages}}",
+        "genre": f"📟 {label['genre']}: {{genres}}",
+        "story_line": f"📋 {label['story_line']}: {{overview}}...",
+        "director": f"🎥 {label['director']}: {{directors}}",
+        "writer": f"✍️ {label['writer']}: {{writers}}",
+        "actors": f"🎎 {label['actors']}: {{casts}}",
+    }
+
+    if media_type == MOVIE_MEDIA_TYPE:
+        title = f"<a href='{IMDB_TITLE_URL}{{imdb_id}}'>{{title}}</a> <i>({{year}})</i>"
+        return {
+            **shared,
+            "title_poster": f"<a href='{{poster_url}}'>🎪</a> {label['movie']}: {title}",
+            "title_imdb": f"🎪 {label['movie']}: {title}",
+            "title_year": f"🎪 {label['movie']}: {{title}} (<i>({{year}})</i>",
+            "title": f"🎪 {label['movie']}: {{title}}",
+            "ratings": f"🏆 {label['user_ratings']}: {RATINGS_TEXT[language]}",
+            "imdb_id": f"🚦 {label['imdb_id']}: <code>{{imdb_id}}</code>",
+            "type": f"🎦 {label['type']}: {label['movie']}",
+            "released_date": f"🗓️ {label['released_date']}: <a href='{IMDB_TITLE_URL}{{imdb_id}}/releaseinfo'>{{release_date}}</a>",
+            "story_line_imdb": f"📋 {label['story_line']}: {{overview}} <a href='{IMDB_TITLE_URL}{{imdb_id}}/plotsummary/'>...</a>",
+        }
+
+    return {
+        **shared,
+        "title_poster": f"<a href='{{poster_url}}'>🎪</a> {label['tv_series']}: {{name}} <i>({{year1}} - {{year2}})</i>",
+        "title_years": f"🎪 {label['tv_series']}: {{name}} <i>({{year1}} - {{year2}})</i>",
+        "title_year": f"🎪 {label['tv_series']}: {{name}} <i>({{year1}})</i>",
+        "title": f"🎪 {label['tv_series']}: {{name}}",
+        "type": f"📺 {label['type']}: {label['tv_series']}",
+        "air_date_range": f"🗓️ {label['air_date']}: {AIR_DATE_RANGE_TEXT[language]}",
+        "air_date": f"🗓️ {label['air_date']}: {{first_air_date}}",
+    }
+
+
+def compile_trailer_layout(language: str) -> dict:
+    """
+    Build the format strings of the trailer button labels in a language.
+    """
+    label = {name: escape_braces(texts[language]) for name, texts in movie_and_tv_detail_lang.items()}
+    return {
+        "official": f" [{label['official_trailer']}]",
+        "non_official": f" [{label['non_official_trailer']}]",
+        "other": " [{type}]",
+    }
+
+
+# compiled once, see compile_layout
+LAYOUTS = {
+    (media_type, language): compile_layout(media_type, language)
+    for media_type in (MOVIE_MEDIA_TYPE, TV_MEDIA_TYPE)
+    for language in (ENG_LANG, FA_LANG)
+}
+TRAILER_LAYOUTS = {language: compile_trailer_layout(language) for language in (ENG_LANG, FA_LANG)}
+
+
+def render_caption(item: dict, media_type: str, language=ENG_LANG) -> str:
+    """
+    Render the caption of a movie or TV series.
+
+    Args:
+        item (dict): The dictionary containing the details of the movie or TV series.
+        media_type (str): The type of media (movie or TV series).
+        language (str, optional): The language of the caption. Defaults to ENG_LANG.
+
+    Returns:
+        str: The HTML caption.
+    """
+    layout = LAYOUTS[(media_type, language)]
+    lines = []
+    if item['poster_path']:
+        poster_url = TMDB_IMG_URL + item['poster_path']
+
+    if media_type == MOVIE_MEDIA_TYPE:
+        imdb_id = item['imdb_id']
+        if item['poster_path'] and imdb_id and item['year']:
+            lines.append(layout['title_poster'].format(poster_url=poster_url, imdb_id=imdb_id,
+                                                       title=item['title'], year=item['year']))
+        elif imdb_id and item['year']:
+            lines.append(layout['title_imdb'].format(imdb_id=imdb_id, title=item['title'], year=item['year']))
+        elif item['year']:
+            lines.append(layout['title_year'].format(title=item['title'], year=item['year']))
+        else:
+            lines.append(layout['title'].format(title=item['title']))
+        if item['vote_average'] and item['vote_count']:
+            lines.append(layout['ratings'].format(vote_average=item['vote_average'], vote_count=item['vote_count']))
+        if imdb_id:
+            lines.append(layout['imdb_id'].format(imdb_id=imdb_id))
+        lines.append(layout['type'])
+        if item['release_date']:
+            lines.append(layout['released_date'].format(imdb_id=imdb_id, release_date=item['release_date']))
+    elif media_type == TV_MEDIA_TYPE:
+        if item['poster_path'] and item['year1'] and item['year2']:
+            lines.append(layout['title_poster'].format(poster_url=poster_url, name=item['name'],
+                                                       year1=item['year1'], year2=item['year2']))
+        elif item['year1'] and item['year2']:
+            lines.append(layout['title_years'].format(name=item['name'], year1=item['year1'], year2=item['year2']))
+        elif item['year1']:
+            lines.append(layout['title_year'].format(name=item['name'], year1=item['year1']))
+        else:
+            lines.append(layout['title'].format(name=item['name']))
+        lines.append(layout['type'])
+        # the search results of TV series have no last air date
+        if 'last_air_date' not in item:
+            if item['first_air_date']:
+                lines.append(layout['air_date'].format(first_air_date=item['first_air_date']))
+        elif item['first_air_date'] and item['last_air_date']:
+            lines.append(layout['air_date_range'].format(first_air_date=item['first_air_date'],
+                                                         last_air_date=item['last_air_date']))
+    else:
+        return ""
+
+    if item['languages']:
+        lines.append(layout['language'].format(languages=' '.join('#' + lang for lang in item['languages'])))
+    if item['genres']:
+        genres = ' '.join('#' + genre.replace(' ', '_').replace('&', 'and') for genre in item['genres'])
+        lines.append(layout['genre'].format(genres=genres))
+    if media_type == MOVIE_MEDIA_TYPE and item['overview'] and item['imdb_id']:
+        lines.append(layout['story_line_imdb'].format(overview=item['overview'][:200], imdb_id=item['imdb_id']))
+    elif item['overview']:
+        lines.append(layout['story_line'].format(overview=item['overview'][:200]))
+    if item['directors']:
+        lines.append(layout['director'].format(directors=' '.join(item['directors'])))
+    if item['writers']:
+        lines.append(layout['writer'].format(writers=' '.join(item['writers'])))
+    if item['casts']:
+        lines.append(layout['actors'].format(casts=' '.join(item['casts'])))
+
+    return '\n'.join(lines)
+
+
+def render_caption_batch(jobs: list) -> list:
+    """
+    Render the captions of many movies or TV series, it runs in the render pool.
+
+    Args:
+        jobs (list): The (item, media_type, language) of each caption, see render_caption.
+
+    Returns:
+        list: The captions in the order of the jobs.
+    """
+    return [render_caption(item, media_type, language) for item, media_type, language in jobs]
+
+
+def get_caption_key(item: dict, media_type: str, language: str, kind: str):
+    # the values stored before the cache version was added are not cached
+    version = item.get('cache_version')
+    if version is None:
+        return None
+    return kind, media_type, item['id'], language, version
+
+
+def get_caption(item: dict, media_type: str, language=ENG_LANG, kind=DETAIL_CAPTION) -> str:
+    """
+    Get the caption of a movie or TV series from the caption cache, or render it.
+    The captions are cached per payload kind, media type, ID, language and cache version
+    of the details, so a refreshed movie or TV series gets a new caption.
+
+    Args:
+        item (dict): The dictionary containing the details of the movie or TV series.
+        media_type (str): The type of media (movie or TV series).
+        language (str, optional): The language of the caption. Defaults to ENG_LANG.
+        kind (str, optional): DETAIL_CAPTION for the full details, LIST_CAPTION for a search
+            result merged with its details. Defaults to DETAIL_CAPTION.
+
+    Returns:
+        str: The HTML caption.
+    """
+    key = get_caption_key(item, media_type, language, kind)
+    caption = caption_cache.get(key) if key else None
+    if caption is None:
+        caption = render_caption(item, media_type, language)
+        if key:
+            caption_cache.set(key, caption)
+    return caption
+
+
+async def render_captions(items: list, language=ENG_LANG, kind=LIST_CAPTION) -> list:
+    """
+    Get the captions of many movies or TV series, see get_caption.
+    The captions which are not cached are rendered in one batch in the render pool.
+
+    Args:
+        items (list): The details of the movies or TV series, with their media_type.
+        language (str, optional): The language of the captions. Defaults to ENG_LANG.
+        kind (str, optional): The kind of the items, see get_caption. Defaults to LIST_CAPTION.
+
+    Returns:
+        list: The captions in the order of the items.
+    """
+    captions = []
+    missing = []
+    for i, item in enumerate(items):
+        key = get_caption_key(item, item['media_type'], language, kind)
+        caption = caption_cache.get(key) if key else None
+        captions.append(caption)
+        if caption is None:
+            missing.append(i)
+
+    if not missing:
+        return captions
+
+    jobs = [(items[i], items[i]['media_type'], language) for i in missing]
+    if render_pool is None:
+        rendered = render_caption_batch(jobs)
+    else:
+        rendered = await asyncio.get_running_loop().run_in_executor(render_pool, render_caption_batch, jobs)
+
+    for i, caption in zip(missing, rendered):
+        captions[i] = caption
+        key = get_caption_key(items[i], items[i]['media_type'], language, kind)
+        if key:
+            caption_cache.set(key, caption)
+    return captions
+
+
+def render_trailer_label(trailer: dict, year: str, language=ENG_LANG) -> str:
+    """
+    Render the label of a trailer button.
+
+    Args:
+        trailer (dict): The trailer, see api.TMDB_parse_trailers.
+        year (str): The year of the movie or TV series, or an empty string.
+        language (str, optional): The language of the label. Defaults to ENG_LANG.
+
+    Returns:
+        str: The label of the button.
+    """
+    layout = TRAILER_LAYOUTS[language]
+    text = f"📺 {trailer['name']}"
+    if year:
+        text += f" ({year})"
+    if trailer['official']:
+        text += layout['official']
+    elif trailer['type'] == "Trailer":
+        text += layout['non_official']
+    else:
+        text += layout['other'].format(type=trailer['type'])
+    return text
+
+
+def init_render_pool(kind=CAPTION_RENDER_POOL, workers=CAPTION_RENDER_WORKERS):
+    """
+    Starts the pool the caption batches are rendered in, called once when the application starts.
+
+    Args:
+        kind (str, optional): "none", "thread" or "process". Defaults to CAPTION_RENDER_POOL.
+        workers (int, optional): The number of workers. Defaults to CAPTION_RENDER_WORKERS.
+    """
+    global render_pool
+    if kind == "thread":
+        render_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="caption-render")
+    elif kind == "process":
+        render_pool = ProcessPoolExecutor(max_workers=workers)
+
+
+def close_render_pool():
+    """
+    Stops the render pool, called when the application stops.
+    """
+    global render_pool
+    if render_pool is not None:
+        render_pool.shutdown(wait=False, cancel_futures=True)
+        render_pool = None
@@ -1,4 +1,8 @@
-from pymongo import MongoClient
+import decouple
+from datetime import datetime, timedelta, timezone
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from cache import TTLCache
 
 
 HOST = "mongo-bot-db"
@@ -9,42 +13,326 @@ COLLECTION_NAMES = (
     "trailers",
     "media_detail",
     "TMDB_media_detail",
+    "posters",
+    "search_results",
+    "flow_state",
+    "cards",
 )
+KEY_INDEX_NAME = "key_unique"
+EXPIRES_AT_INDEX_NAME = "expires_at_ttl"
+DAY = 24 * 60 * 60
+# seconds after which a cached TMDB value is refreshed in the background,
+# and seconds after which Mongo deletes it
+COLLECTION_TTLS = {
+    "trailers": (
+        decouple.config("TRAILERS_STALE_AFTER", default=7 * DAY, cast=int),
+        decouple.config("TRAILERS_EXPIRE_AFTER", default=30 * DAY, cast=int),
+    ),
+    "media_detail": (
+        decouple.config("MEDIA_DETAIL_STALE_AFTER", default=DAY, cast=int),
+        decouple.config("MEDIA_DETAIL_EXPIRE_AFTER", default=30 * DAY, cast=int),
+    ),
+    "TMDB_media_detail": (
+        decouple.config("MEDIA_DETAIL_STALE_AFTER", default=DAY, cast=int),
+        decouple.config("MEDIA_DETAIL_EXPIRE_AFTER", default=30 * DAY, cast=int),
+    ),
+    "search_results": (
+        decouple.config("SEARCH_RESULTS_STALE_AFTER", default=6 * 60 * 60, cast=int),
+        decouple.config("SEARCH_RESULTS_EXPIRE_AFTER", default=7 * DAY, cast=int),
+    ),
+    # the rendered detail cards, they are rebuilt from the details when stale
+    "cards": (
+        decouple.config("MEDIA_DETAIL_STALE_AFTER", default=DAY, cast=int),
+        decouple.config("MEDIA_DETAIL_EXPIRE_AFTER", default=30 * DAY, cast=int),
+    ),
+    # the state of the conversations is never refreshed, it only expires
+    "flow_state": (
+        decouple.config("FLOW_STATE_EXPIRE_AFTER", default=60 * 60, cast=int),
+        decouple.config("FLOW_STATE_EXPIRE_AFTER", default=60 * 60, cast=int),
+    ),
+}
+CACHE_MAXSIZE = decouple.config("CACHE_MAXSIZE", default=10000, cast=int)
+CACHE_TTL = decouple.config("CACHE_TTL", default=3600, cast=int)
 
 
-def get_database():
-    # Connect to the MongoDB container
-    client = MongoClient(host=HOST, port=PORT)
+def get_database(client):
+    return client[DB_NAME]
 
+
+async def create_database(client):
     # create a db if not exist
-    if DB_NAME not in client.list_database_names():
-        db = client[DB_NAME]
+    if DB_NAME not in await client.list_database_names():
         print("Database created:", DB_NAME)
     else:
-        db = client[DB_NAME]
         print("Database already exists:", DB_NAME)
 
-    return db
-
 
-def create_collection(db, collection_names):
+async def create_collection(db, collection_names):
+    collection_list = await db.list_collection_names()
     for collection in collection_names:
         # create a collection if not exist
-        if collection not in db.list_collection_names():
-            collection = db[collection]
-            print("Collection created:", collection)
+        if collection not in collection_list:
+            collection = await db.create_collection(collection)
+            print("Collection created:", collection.name)
         else:
             collection = db[collection]
-            print("Collection already exists:", collection)
+            print("Collection already exists:", collection.name)
 
 
 def get_collection(db, collection_name):
     return db[collection_name]
 
 
-db = get_database()
-create_collection(db, COLLECTION_NAMES)
+async def remove_duplicate_keys(collection):
+    """
+    Removes the documents which would break the unique index of the key field,
+    the newest document of every duplicated key is kept.
+
+    Args:
+        collection (motor.motor_asyncio.AsyncIOMotorCollection): The collection to clean.
+
+    Returns:
+        int: The number of removed documents.
+    """
+    # older versions stored the whole filter as the key of media_detail
+    result = await collection.delete_many({"key": {"$not": {"$type": "string"}}})
+    removed = result.deleted_count
+
+    pipeline = [
+        {"$group": {"_id": "$key", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    async for group in collection.aggregate(pipeline, allowDiskUse=True):
+        # ObjectIds grow with the insertion time
+        ids = sorted(group["ids"])[:-1]
+        result = await collection.delete_many({"_id": {"$in": ids}})
+        removed += result.deleted_count
+
+    return removed
+
+
+async def create_key_index(db, collection_names):
+    for collection in collection_names:
+        collection = db[collection]
+        removed = await remove_duplicate_keys(collection)
+        if removed:
+            print("Duplicate documents removed:", collection.name, removed)
+
+        # a no-op if the index already exists
+        await collection.create_index("key", unique=True, name=KEY_INDEX_NAME)
+        indexes = await collection.index_information()
+        if indexes.get(KEY_INDEX_NAME, {}).get("unique"):
+            print("Unique key index is ready:", collection.name)
+        else:
+            print("Unique key index is missing:", collection.name)
+
+
+async def create_expires_at_index(db, collection_ttls):
+    for collection, (_, expire_after) in collection_ttls.items():
+        collection = db[collection]
+        # documents stored before the TTL policy expire like new ones
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=expire_after)
+        result = await collection.update_many({"expires_at": {"$exists": False}},
+                                              {"$set": {"expires_at": expires_at}})
+        if result.modified_count:
+            print("Expiry date added:", collection.name, result.modified_count)
+
+        await collection.create_index("expires_at", expireAfterSeconds=0, name=EXPIRES_AT_INDEX_NAME)
+        print("TTL index is ready:", collection.name)
+
+
+async def init_db():
+    """
+    Creates the database, its collections and their indexes if they do not exist,
+    called once when the application starts.
+    """
+    await create_database(client)
+    await create_collection(db, COLLECTION_NAMES)
+    await create_key_index(db, COLLECTION_NAMES)
+    await create_expires_at_index(db, COLLECTION_TTLS)
+
+
+# Connect to the MongoDB container, the connection is opened on the first operation
+client = AsyncIOMotorClient(host=HOST, port=PORT, tz_aware=True)
+db = get_database(client)
 users_lang_clt = get_collection(db, COLLECTION_NAMES[0])
 trailers_clt = get_collection(db, COLLECTION_NAMES[1])
 media_detail_clt = get_collection(db, COLLECTION_NAMES[2])
 TMDB_media_detail_clt = get_collection(db, COLLECTION_NAMES[3])
+posters_clt = get_collection(db, COLLECTION_NAMES[4])
+search_results_clt = get_collection(db, COLLECTION_NAMES[5])
+flow_state_clt = get_collection(db, COLLECTION_NAMES[6])
+cards_clt = get_collection(db, COLLECTION_NAMES[7])
+
+# in-process caches in front of the collections, see find_value and save_value
+caches = {name: TTLCache(CACHE_MAXSIZE, CACHE_TTL) for name in COLLECTION_NAMES}
+
+
+def is_stale(collection, updated_at):
+    """
+    Checks if a value must be refreshed, see COLLECTION_TTLS.
+
+    Args:
+        collection (motor.motor_asyncio.AsyncIOMotorCollection): The collection of the value.
+        updated_at (datetime.datetime): When the value was stored, None for old documents.
+
+    Returns:
+        bool: True if the value is stale.
+    """
+    if collection.name not in COLLECTION_TTLS:
+        return False
+    if updated_at is None:
+        return True
+    stale_after, _ = COLLECTION_TTLS[collection.name]
+    return datetime.now(timezone.utc) - updated_at > timedelta(seconds=stale_after)
+
+
+async def find_entry(collection, key, default=None):
+    """
+    Returns the value stored for a key and whether it is stale,
+    from the in-process cache if possible.
+
+    Args:
+        collection (motor.motor_asyncio.AsyncIOMotorCollection): The collection of the key.
+        key (str): The key of the document.
+        default (optional): The value returned if the key does not exist. Defaults to None.
+
+    Returns:
+        tuple: The value of the document, or default if the key does not exist,
+            and True if the value is stale.
+    """
+    cache = caches[collection.name]
+    entry = cache.get(key)
+    if entry is None:
+        document = await collection.find_one({"key": key})
+        if not document:
+            return default, False
+        entry = (document.get("value"), document.get("updated_at"))
+        cache.set(key, entry)
+
+    value, updated_at = entry
+    return value, is_stale(collection, updated_at)
+
+
+async def find_value(collection, key, default=None):
+    """
+    Returns the value stored for a key, from the in-process cache if possible.
+    Stale values are returned too, see find_entry.
+
+    Args:
+        collection (motor.motor_asyncio.AsyncIOMotorCollection): The collection of the key.
+        key (str): The key of the document.
+        default (optional): The value returned if the key does not exist. Defaults to None.
+
+    Returns:
+        The value of the document, or default if the key does not exist.
+    """
+    value, _ = await find_entry(collection, key, default)
+    return value
+
+
+async def save_value(collection, key, value):
+    """
+    Stores the value of a key in the collection and in the in-process cache.
+
+    Args:
+        collection (motor.motor_asyncio.AsyncIOMotorCollection): The collection of the key.
+        key (str): The key of the document.
+        value: The value to store.
+    """
+    updated_at = datetime.now(timezone.utc)
+    document = {"key": key,
+                "value": value,
+                "updated_at": updated_at}
+    if collection.name in COLLECTION_TTLS:
+        _, expire_after = COLLECTION_TTLS[collection.name]
+        document["expires_at"] = updated_at + timedelta(seconds=expire_after)
+
+    await collection.update_one({"key": key},
+                                {"$set": document},
+                                upsert=True)
+    caches[collection.name].set(key, (value, updated_at))
+
+
+async def find_values(collection, keys):
+    """
+    Returns the values stored for several keys and whether they are stale with one query,
+    the keys in the in-process cache are not queried, see find_entry.
+
+    Args:
+        collection (motor.motor_asyncio.AsyncIOMotorCollection): The collection of the keys.
+        keys (list): The keys of the documents.
+
+    Returns:
+        dict: The (value, stale) tuples by key, the keys which do not exist are left out.
+    """
+    cache = caches[collection.name]
+    values = {}
+    missing_keys = []
+    for key in keys:
+        entry = cache.get(key)
+        if entry is None:
+            missing_keys.append(key)
+        else:
+            values[key] = (entry[0], is_stale(collection, entry[1]))
+
+    if missing_keys:
+        async for document in collection.find({"key": {"$in": missing_keys}}):
+            entry = (document.get("value"), document.get("updated_at"))
+            cache.set(document["key"], entry)
+            values[document["key"]] = (entry[0], is_stale(collection, entry[1]))
+
+    return values
+
+
+async def save_values(collection, values):
+    """
+    Stores the values of several keys with one bulk write, see save_value.
+
+    Args:
+        collection (motor.motor_asyncio.AsyncIOMotorCollection): The collection of the keys.
+        values (dict): The values by key.
+    """
+    if not values:
+        return
+
+    updated_at = datetime.now(timezone.utc)
+    requests = []
+    for key, value in values.items():
+        document = {"key": key,
+                    "value": value,
+                    "updated_at": updated_at}
+        if collection.name in COLLECTION_TTLS:
+            _, expire_after = COLLECTION_TTLS[collection.name]
+            document["expires_at"] = updated_at + timedelta(seconds=expire_after)
+        requests.append(UpdateOne({"key": key}, {"$set": document}, upsert=True))
+
+    await collection.bulk_write(requests, ordered=False)
+    for key, value in values.items():
+        caches[collection.name].set(key, (value, updated_at))
+
+
+async def delete_values(collection, keys):
+    """
+    Removes the values of several keys from the collection and from the in-process cache.
+
+    Args:
+        collection (motor.motor_asyncio.AsyncIOMotorCollection): The collection of the keys.
+        keys (list): The keys of the documents.
+    """
+    if not keys:
+        return
+
+    await collection.delete_many({"key": {"$in": list(keys)}})
+    for key in keys:
+        caches[collection.name].delete(key)
+
+
+def get_cache_stats():
+    """
+    Returns the statistics of the in-process caches.
+
+    Returns:
+        dict: The statistics of each cache by collection name.
+    """
+    return {name: cache.stats() for name, cache in caches.items()}
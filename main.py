@@ -1,12 +1,13 @@
 import re
 import json
+import asyncio
 import decouple
 import logging
-import requests
 import html
 import traceback
 from telegram import (
     Update,
+    Message,
     BotCommand,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
@@ -16,7 +17,7 @@ from telegram import (
     InlineQueryResultPhoto,
     InlineQueryResultsButton,
 )
-from telegram.constants import ParseMode
+from telegram.constants import ParseMode, MediaGroupLimit
 from telegram.error import BadRequest
 from telegram.ext import (
     filters,
@@ -29,10 +30,17 @@ from telegram.ext import (
     ChosenInlineResultHandler,
 )
 from api import (
+    TMDBUnavailableError,
     TMDB_search_response_bot,
-    TMDB_get_movie_additional_detail,
-    TMDB_get_tv_series_additional_detail,
-    TMDB_get_trailer,
+    TMDB_search_response_lite,
+    TMDB_get_media,
+    TMDB_get_trailers_bulk,
+    download_image,
+    init_http_client,
+    close_http_client,
+    get_http_pool_stats,
+    get_tmdb_stats,
+    media_flight,
     TMDB_MOVIE_DETAIL,
     TMDB_TV_SERIES_DETAIL,
     TV_MEDIA_TYPE,
@@ -41,18 +49,70 @@ from api import (
     TMDB_MOVIE_PAGE,
     TMDB_TV_SERIES_PAGE,
 )
+from webhook import run_webhook
+from state import flow_state
+from rate_limiter import TelegramRateLimiter, BULK
+from update_processor import ChatOrderedUpdateProcessor
+from captions import (
+    ENG_LANG,
+    FA_LANG,
+    movie_and_tv_detail_lang,
+    get_caption,
+    render_captions,
+    render_trailer_label,
+    caption_cache,
+    init_render_pool,
+    close_render_pool,
+)
 from db import (
     users_lang_clt,
-    trailers_clt,
+    posters_clt,
     media_detail_clt,
+    cards_clt,
+    find_entry,
+    find_value,
+    save_value,
+    get_cache_stats,
+    init_db,
 )
 
 
 TOKEN = decouple.config('TOKEN')
 DEVELOPER_CHAT_ID = decouple.config('DEVELOPER_CHAT_ID', cast=int)
 IMDB_IMG_URL = r"https://upload.wikimedia.org/wikipedia/commons/thumb/c/cc/IMDb_Logo_Square.svg/480px-IMDb_Logo_Square.svg.png"
-ENG_LANG = "en-US"
-FA_LANG = "fa-IR"
+FALLBACK_POSTER = "imdb-logo"
+INLINE_QUERY_DEBOUNCE = decouple.config('INLINE_QUERY_DEBOUNCE', default=0.4, cast=float)
+INLINE_PAGE_SIZE = decouple.config('INLINE_PAGE_SIZE', default=10, cast=int)
+# seconds Telegram may cache the inline answers, by the type of the answer, the answers are
+# localized and mention the user, so Telegram caches them per user (is_personal)
+INLINE_CACHE_TIMES = {
+    "empty": decouple.config('INLINE_CACHE_TIME_EMPTY', default=3600, cast=int),
+    "results": decouple.config('INLINE_CACHE_TIME_RESULTS', default=300, cast=int),
+    "not_found": decouple.config('INLINE_CACHE_TIME_NOT_FOUND', default=60, cast=int),
+}
+# "polling" or "webhook"
+BOT_MODE = decouple.config('BOT_MODE', default="polling")
+WEBHOOK_URL = decouple.config('WEBHOOK_URL', default="")
+WEBHOOK_LISTEN = decouple.config('WEBHOOK_LISTEN', default="0.0.0.0")
+WEBHOOK_PORT = decouple.config('WEBHOOK_PORT', default=8443, cast=int)
+WEBHOOK_PATH = decouple.config('WEBHOOK_PATH', default="/telegram")
+# an empty value is missing, the webhook does not start without it
+WEBHOOK_SECRET_TOKEN = decouple.config('WEBHOOK_SECRET_TOKEN', default="") or None
+# the base urls of all the replicas and the index of this one, see webhook.get_partition
+WEBHOOK_REPLICA_URLS = decouple.config('WEBHOOK_REPLICA_URLS', default="", cast=decouple.Csv())
+WEBHOOK_REPLICA_INDEX = decouple.config('WEBHOOK_REPLICA_INDEX', default=0, cast=int)
+# the local listener of /healthz in webhook mode, it is not exposed with the webhook
+HEALTH_LISTEN = decouple.config('HEALTH_LISTEN', default="127.0.0.1")
+HEALTH_PORT = decouple.config('HEALTH_PORT', default=8080, cast=int)
+MAX_CONCURRENT_UPDATES = decouple.config('MAX_CONCURRENT_UPDATES', default=32, cast=int)
+TELEGRAM_OVERALL_RATE = decouple.config('TELEGRAM_OVERALL_RATE', default=30, cast=float)
+TELEGRAM_CHAT_RATE = decouple.config('TELEGRAM_CHAT_RATE', default=1, cast=float)
+TELEGRAM_CHAT_BURST = decouple.config('TELEGRAM_CHAT_BURST', default=3, cast=int)
+TELEGRAM_GROUP_RATE = decouple.config('TELEGRAM_GROUP_RATE', default=20 / 60, cast=float)
+TELEGRAM_MAX_RETRIES = decouple.config('TELEGRAM_MAX_RETRIES', default=3, cast=int)
+LIST_MAX_RESULTS = decouple.config('LIST_MAX_RESULTS', default=20, cast=int)
+# send the /list results as albums instead of one photo per result
+LIST_MEDIA_GROUP = decouple.config('LIST_MEDIA_GROUP', default=True, cast=bool)
 
 """
 function commands
@@ -66,174 +126,65 @@ logging.basicConfig(
 logging.getLogger("httpx").setLevel(logging.INFO)
 
 logger = logging.getLogger(__name__)
-lang_from_start = {}
-lang_from_language_callback = {}
-movie_and_tv_detail_lang = {
-    "movie": {
-        ENG_LANG: "Movie",
-        FA_LANG: "فیلم",
-    },
-    "tv_series": {
-        ENG_LANG: "Tv Series",
-        FA_LANG: "سریال تلوزیونی",
-    },
-    "user_ratings": {
-        ENG_LANG: "Usᴇʀ Rᴀᴛɪɴɢs",
-        FA_LANG: "امتیاز کاربران",
-    },
-    "imdb_id": {
-        ENG_LANG: "𝙸ᴍᴅʙ 𝙸ᴅ",
-        FA_LANG: "آیدی آی‌ام‌دی‌بی",
-    },
-    "type": {
-        ENG_LANG: "Type",
-        FA_LANG: "نوع",
-    },
-    "released_date": {
-        ENG_LANG: "Rᴇʟᴇᴀsᴇ Dᴀᴛᴇ",
-        FA_LANG: "تاریخ انتشار",
-    },
-    "language": {
-        ENG_LANG: "Lᴀɴɢᴜᴀɢᴇ",
-        FA_LANG: "زبان",
-    },
-    "genre": {
-        ENG_LANG: "Gᴇɴʀᴇ",
-        FA_LANG: "ژانر",
-    },
-    "story_line": {
-        ENG_LANG: "Sᴛᴏʀy Lɪɴᴇ",
-        FA_LANG: "خلاصه داستان",
-    },
-    "director": {
-        ENG_LANG: "Dɪʀᴇᴄᴛᴏʀ",
-        FA_LANG: "کارگردان",
-    },
-    "writer": {
-        ENG_LANG: "Wʀɪᴛᴇʀ",
-        FA_LANG: "نویسنده",
-    },
-    "actors": {
-        ENG_LANG: "Aᴄᴛᴏʀs",
-        FA_LANG: "بازیگران",
-    },
-    "air_date": {
-        ENG_LANG: "Air Dᴀᴛᴇ",
-        FA_LANG: "تاریخ پخش",
-    },
-    "season": {
-        ENG_LANG: "Season",
-        FA_LANG: "فصل",
-    },
-    "episode": {
-        ENG_LANG: "Episode",
-        FA_LANG: "قسمت",
-    },
-    "official_trailer": {
-        ENG_LANG: "Official trailer",
-        FA_LANG: "تریلر رسمی",
-    },
-    "non_official_trailer": {
-        ENG_LANG: "Non official trailer",
-        FA_LANG: "تریلر غیر رسمی",
-    },
-}
+# the IMDB logo, it is downloaded once in post_init
+fallback_poster = IMDB_IMG_URL
+# the inline query being answered for each user, see inline_query
+inline_query_tasks = {}
+
+
+async def get_poster(poster_path: str):
+    """
+    Get the photo to send for a poster without downloading it.
+
+    The Telegram file_id of the poster is used if it was uploaded before,
+    otherwise the TMDB url of the poster, which Telegram downloads itself.
+    Without a poster, the IMDB logo loaded at startup is used.
+
+    Args:
+        poster_path (str): The TMDB poster path of the movie or TV series.
+
+    Returns:
+        str or bytes: The file_id, url or content of the poster.
+    """
+    poster = await find_value(posters_clt, f"poster---{poster_path or FALLBACK_POSTER}")
+    if poster:
+        return poster
+    if poster_path:
+        return TMDB_IMG_URL + poster_path
+    return fallback_poster
+
 
+async def save_poster(poster_path: str, photo, message) -> None:
+    """
+    Save the Telegram file_id of a sent poster, so it is never downloaded or uploaded again.
 
-def TMDB_MOVIE_or_TV_series_detail(item: dict, media_type: str, img_url=False, language=ENG_LANG) -> tuple:
+    Args:
+        poster_path (str): The TMDB poster path of the movie or TV series.
+        photo (str or bytes): The photo which was sent, see get_poster.
+        message (telegram.Message): The message containing the sent photo.
+    """
+    if not isinstance(message, Message) or not message.photo:
+        return
+    file_id = message.photo[-1].file_id
+    if photo == file_id:
+        return
+    await save_value(posters_clt, f"poster---{poster_path or FALLBACK_POSTER}", file_id)
+
+
+async def TMDB_MOVIE_or_TV_series_detail(item: dict, media_type: str, language=ENG_LANG) -> tuple:
     """
     Get details of a movie or TV series from TMDB API response.
 
     Args:
         item (dict): The dictionary containing the details of the movie or TV series.
         media_type (str): The type of media (movie or TV series).
-        img_url (bool, optional): Flag indicating whether to include the image URL. Defaults to False.
 
     Returns:
-        tuple: A tuple containing the image and the string formatted details of the movie or TV series.
+        tuple: A tuple containing the poster, see get_poster, and the string formatted details
+            of the movie or TV series, see captions.get_caption.
     """
-    img = b""
-    if img_url:
-        img = ""
-    if img_url and item['poster_path']:
-        img = IMDB_IMG_URL + item['poster_path']
-    temp = []
-    if media_type == MOVIE_MEDIA_TYPE:
-        if item['poster_path']:
-            if not img_url:
-                img = requests.get(f"{TMDB_IMG_URL}{item['poster_path']}").content
-        if item['poster_path'] and item["imdb_id"] and item['year']:
-            temp.append(f"<a href='{TMDB_IMG_URL + item['poster_path']}'>🎪</a> {movie_and_tv_detail_lang['movie'][language]}: <a href='https://www.imdb.com/title/{item['imdb_id']}'>{item['title']}</a> <i>({item['year']})</i>")
-        elif item["imdb_id"] and item['year']:
-            temp.append(f"🎪 {movie_and_tv_detail_lang['movie'][language]}: <a href='https://www.imdb.com/title/{item['imdb_id']}'>{item['title']}</a> <i>({item['year']})</i>")
-        elif item['year']:
-            temp.append(f"🎪 {movie_and_tv_detail_lang['movie'][language]}: {item['title']} (<i>({item['year']})</i>")
-        else:
-            temp.append(f"🎪 {movie_and_tv_detail_lang['movie'][language]}: {item['title']}")
-        if item['vote_average'] and item['vote_count']:
-            if language == ENG_LANG:
-                temp.append(f"🏆 {movie_and_tv_detail_lang['user_ratings'][language]}: {item['vote_average']:.1f} / 10  <code>({item['vote_average']:.1f} based on {item['vote_count']} user ratings)</code>")
-            elif language == FA_LANG:
-                temp.append(f"🏆 {movie_and_tv_detail_lang['user_ratings'][language]}: 10 / {item['vote_average']:.1f}  <code>({item['vote_average']:.1f} بر اساس امتیاز {item['vote_count']} کاربر)</code>")
-        if item["imdb_id"]:
-            temp.append(f"🚦 {movie_and_tv_detail_lang['imdb_id'][language]}: <code>{item['imdb_id']}</code>")
-        temp.append(f"🎦 {movie_and_tv_detail_lang['type'][language]}: {movie_and_tv_detail_lang['movie'][language]}")
-        if item["release_date"]:
-            temp.append(f"🗓️ {movie_and_tv_detail_lang['released_date'][language]}: <a href='https://www.imdb.com/title/{item['imdb_id']}/releaseinfo'>{item['release_date']}</a>")
-        if item['languages']:
-            temp.append(f"💬 {movie_and_tv_detail_lang['language'][language]}: {' '.join(['#'+lang for lang in item['languages']])}")
-        if item['genres']:
-            temp.append(f"📟 {movie_and_tv_detail_lang['genre'][language]}: {' '.join(['#'+genre.replace(' ', '_').replace('&', 'and') for genre in item['genres']])}")
-        if item['overview'] and item['imdb_id']:
-            temp.append(f"📋 {movie_and_tv_detail_lang['story_line'][language]}: {item['overview'][:200]} <a href='https://www.imdb.com/title/{item['imdb_id']}/plotsummary/'>...</a>")
-        elif item['overview']:
-            temp.append(f"📋 {movie_and_tv_detail_lang['story_line'][language]}: {item['overview'][:200]}...")
-        if item['directors']:
-            temp.append(f"🎥 {movie_and_tv_detail_lang['director'][language]}: {' '.join([d for d in item['directors']])}")
-        if item['writers']:
-            temp.append(f"✍️ {movie_and_tv_detail_lang['writer'][language]}: {' '.join([w for w in item['writers']])}")
-        if item['casts']:
-            temp.append(f"🎎 {movie_and_tv_detail_lang['actors'][language]}: {' '.join([a for a in item['casts']])}")
-    elif media_type == TV_MEDIA_TYPE:
-        if item['poster_path']:
-            if not img_url:
-                img = requests.get(f"{TMDB_IMG_URL}{item['poster_path']}").content
-        if item['poster_path'] and item['year1'] and item['year2']:
-            temp.append(f"<a href='{TMDB_IMG_URL + item['poster_path']}'>🎪</a> {movie_and_tv_detail_lang['tv_series'][language]}: {item['name']} <i>({item['year1']} - {item['year2']})</i>")
-        elif item['year1'] and item['year2']:
-            temp.append(f"🎪 {movie_and_tv_detail_lang['tv_series'][language]}: {item['name']} <i>({item['year1']} - {item['year2']})</i>")
-        elif item['year1']:
-            temp.append(f"🎪 {movie_and_tv_detail_lang['tv_series'][language]}: {item['name']} <i>({item['year1']})</i>")
-        else:
-            temp.append(f"🎪 {movie_and_tv_detail_lang['tv_series'][language]}: {item['name']}")
-        temp.append(f"📺 {movie_and_tv_detail_lang['type'][language]}: {movie_and_tv_detail_lang['tv_series'][language]}")
-        try:
-            if item['first_air_date'] and item['last_air_date']:
-                if language == ENG_LANG:
-                    temp.append(f"🗓️ {movie_and_tv_detail_lang['air_date'][language]}: {item['first_air_date']} to {item['last_air_date']}")
-                elif language == FA_LANG:
-                    temp.append(f"🗓️ {movie_and_tv_detail_lang['air_date'][language]}: {item['first_air_date']} تا {item['last_air_date']}")
-        except KeyError:
-            if item['first_air_date']:
-                temp.append(f"🗓️ {movie_and_tv_detail_lang['air_date'][language]}: {item['first_air_date']}")
-        if item['languages']:
-            temp.append(f"💬 {movie_and_tv_detail_lang['language'][language]}: {' '.join(['#'+lang for lang in item['languages']])}")
-        if item['genres']:
-            temp.append(f"📟 {movie_and_tv_detail_lang['genre'][language]}: {' '.join(['#'+genre.replace(' ', '_').replace('&', 'and') for genre in item['genres']])}")
-        try:
-            if item['overview']:
-                temp.append(f"📋 {movie_and_tv_detail_lang['story_line'][language]}: {item['overview'][:200]}...")
-        except KeyError:
-            if item['overview']:
-                temp.append(f"📋 {movie_and_tv_detail_lang['story_line'][language]}: {item['overview'][:200]}...")
-        if item['directors']:
-            temp.append(f"🎥 {movie_and_tv_detail_lang['director'][language]}: {' '.join([d for d in item['directors']])}")
-        if item['writers']:
-            temp.append(f"✍️ {movie_and_tv_detail_lang['writer'][language]}: {' '.join([w for w in item['writers']])}")
-        if item['casts']:
-            temp.append(f"🎎 {movie_and_tv_detail_lang['actors'][language]}: {' '.join([a for a in item['casts']])}")
-
-    return img, '\n'.join(temp)
+    img = await get_poster(item['poster_path'])
+    return img, get_caption(item, media_type, language)
 
 
 def get_inline_keyboard_trailer(trailers: list, media_type: str, item: dict, language=ENG_LANG) -> list:
@@ -248,34 +199,99 @@ def get_inline_keyboard_trailer(trailers: list, media_type: str, item: dict, lan
     Returns:
         list: List of inline keyboards for trailers.
     """
+    if not trailers:
+        return []
+
+    year = ""
+    if media_type == MOVIE_MEDIA_TYPE and item['year']:
+        year = item['year']
+    elif media_type == TV_MEDIA_TYPE and item['year1'] and item['year2']:
+        year = f"{item['year1']}-{item['year2']}"
+    elif media_type == TV_MEDIA_TYPE and item['year1']:
+        year = f"{item['year1']}"
 
     inline_keyboards = []
-    if trailers:
-        for trailer in trailers:
-            year = ""
-            if media_type == MOVIE_MEDIA_TYPE and item['year']:
-                year = item['year']
-            elif media_type == TV_MEDIA_TYPE and item['year1'] and item['year2']:
-                year = f"{item['year1']}-{item['year2']}"
-            elif media_type == TV_MEDIA_TYPE and item['year1']:
-                year = f"{item['year1']}"
-
-            text = f"📺 {trailer['name']}"
-            if year:
-                text += f" ({year})"
-            if trailer['official']:
-                text += f" [{movie_and_tv_detail_lang['official_trailer'][language]}]"
-            elif not trailer['official'] and trailer['type'] == "Trailer":
-                text += f" [{movie_and_tv_detail_lang['non_official_trailer'][language]}]"
-            else:
-                text += f" [{trailer['type']}]"
-            inline_keyboards.append(
-                [InlineKeyboardButton(text=text, url=trailer['url'])]
-            )
+    for trailer in trailers:
+        inline_keyboards.append(
+            [InlineKeyboardButton(text=render_trailer_label(trailer, year, language), url=trailer['url'])]
+        )
 
     return inline_keyboards
 
 
+async def get_card(ids, media_type: str, language=ENG_LANG) -> dict:
+    """
+    Get the rendered detail card of a movie or TV series: its caption, trailer keyboard and poster.
+
+    The cards are stored in the cards collection, so a detail view only needs one lookup.
+    A missing or stale card is rendered again from the details, see TMDB_get_media.
+    The card is removed when the details or the trailers are stored again, see api.invalidate_cards,
+    and it keeps the cache_version of its details, so a card stored again after the removal by
+    a slower render or poster upload is stale too.
+
+    Args:
+        ids (int): The ID of the movie or TV series.
+        media_type (str): The type of media (movie or TV series).
+        language (str, optional): The language of the user. Defaults to ENG_LANG.
+
+    Returns:
+        dict: The card, or None if the details are not cached and TMDB is unavailable.
+    """
+    key = f"card---{media_type}---{ids}---{language}"
+    card, stale = await find_entry(cards_clt, key)
+    if card and not stale:
+        item = await find_value(media_detail_clt, f"{media_type}---{ids}---{language}")
+        if item and item.get("cache_version") == card.get("cache_version"):
+            return card
+
+    item, trailers = await TMDB_get_media(ids, media_type, language)
+    if not item:
+        # the stale card is better than nothing
+        return card
+
+    img, caption = await TMDB_MOVIE_or_TV_series_detail(item, media_type, language=language)
+    inline_keyboards = get_inline_keyboard_trailer(trailers, media_type, item, language)[::-1]
+    card = {
+        "caption": caption,
+        "keyboard": InlineKeyboardMarkup(inline_keyboards).to_dict() if inline_keyboards else None,
+        # the uploaded IMDB logo is not stored, see get_poster
+        "poster": img if isinstance(img, str) else None,
+        "poster_path": item['poster_path'],
+        "cache_version": item.get("cache_version"),
+    }
+    await save_value(cards_clt, key, card)
+    return card
+
+
+async def save_card_poster(card: dict, ids, media_type: str, language, photo, message) -> None:
+    """
+    Save the Telegram file_id of the poster sent with a card, in the card and in the posters, see save_poster.
+
+    Args:
+        card (dict): The card, see get_card.
+        ids (int): The ID of the movie or TV series.
+        media_type (str): The type of media (movie or TV series).
+        language (str): The language of the card.
+        photo (str or bytes): The photo which was sent.
+        message (telegram.Message): The message containing the sent photo.
+    """
+    await save_poster(card['poster_path'], photo, message)
+    if not isinstance(message, Message) or not message.photo:
+        return
+    file_id = message.photo[-1].file_id
+    if card['poster'] != file_id:
+        await save_value(cards_clt, f"card---{media_type}---{ids}---{language}", {**card, "poster": file_id})
+
+
+def get_card_markup(card: dict, bot):
+    """
+    Get the trailer keyboard of a card, see get_card.
+    """
+    if not card['keyboard']:
+        return None
+    return InlineKeyboardMarkup.de_json(card['keyboard'], bot)
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Handle the /start command.
@@ -288,12 +304,10 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     name = user.first_name if user.first_name else user.last_name
     user_mention = f"<a href='tg://user?id={user.id}'>{name}</a>"
 
-    lang = users_lang_clt.find_one({"key": f"userlang---{user.id}"})
-    if lang:
-        lang = lang.get("value")
-    else:
+    lang = await find_value(users_lang_clt, f"userlang---{user.id}")
+    if not lang:
         await language(update, context)
-        lang_from_start[f"from-start---{user.id}"] = True
+        await flow_state.set(f"from-start---{user.id}", True)
         return
 
 
@@ -349,11 +363,7 @@ async def language(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     """
     user = update.effective_chat
-    lang = users_lang_clt.find_one({"key": f"userlang---{user.id}"})
-    if lang:
-        lang = lang.get("value")
-    else:
-        lang = ENG_LANG
+    lang = await find_value(users_lang_clt, f"userlang---{user.id}", ENG_LANG)
 
     en_text = "Please choose your language"
     fa_text = "لطفا زبان خود را انتخاب کنید"
@@ -404,12 +414,8 @@ async def language_callback_query(update: Update, context: ContextTypes.DEFAULT_
     user = update.effective_chat
     _, lang = query.data.split('---')
     try:
-        _ = users_lang_clt.update_one({"key": f"userlang---{user.id}"},
-                                      {"$set": {"key": f"userlang---{user.id}",
-                                                "value": lang}},
-                                       upsert=True
-        )
-        start = lang_from_start.get(f"from-start---{user.id}", "")
+        await save_value(users_lang_clt, f"userlang---{user.id}", lang)
+        start = await flow_state.get(f"from-start---{user.id}", "")
         if lang == ENG_LANG and start:
             text = "The bot language is successfully selected as <b>English</b>."
         elif lang == FA_LANG and start:
@@ -419,7 +425,7 @@ async def language_callback_query(update: Update, context: ContextTypes.DEFAULT_
         elif lang == FA_LANG:
             text = "زبان ربات با موفقیت به <b>فارسی</b> تغییر کرد.\nبرای دیدن دستورات ربات روی دستور /help بزنید."
         # for change help command
-        lang_from_start[f"from-lang-callback---{user.id}"] = True
+        await flow_state.set(f"from-lang-callback---{user.id}", True)
         await help(update, context)
     except:
         if lang == ENG_LANG:
@@ -433,7 +439,7 @@ async def language_callback_query(update: Update, context: ContextTypes.DEFAULT_
     )
     try:
         if start:
-            del lang_from_start[f"from-start---{user.id}"]
+            await flow_state.pop(f"from-start---{user.id}")
             name = user.first_name if user.first_name else user.last_name
             user_mention = f"<a href='tg://user?id={user.id}'>{name}</a>"
             en_start_text = f"""Hi {user_mention}👋. This is <code>IMDB</code> bot!
@@ -488,11 +494,7 @@ async def help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         None
     """
     user = update.effective_chat
-    lang = users_lang_clt.find_one({"key": f"userlang---{user.id}"})
-    if lang:
-        lang = lang.get("value")
-    else:
-        lang = ENG_LANG
+    lang = await find_value(users_lang_clt, f"userlang---{user.id}", ENG_LANG)
 
     en_start_desc = "Start the bot"
     fa_start_desc = "استارت ربات"
@@ -529,9 +531,8 @@ async def help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await context.bot.set_my_commands(command_list[:3])
 
     # for change command description with change language
-    from_lang = lang_from_start.get(f"from-lang-callback---{user.id}", False)
+    from_lang = await flow_state.pop(f"from-lang-callback---{user.id}", False)
     if from_lang:
-        del lang_from_start[f"from-lang-callback---{user.id}"]
         return
 
     command_list_text = []
@@ -596,9 +597,8 @@ async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE):
         None
     """
     user = update.effective_chat
-    lang = users_lang_clt.find_one({"key": f"userlang---{user.id}"})
+    lang = await find_value(users_lang_clt, f"userlang---{user.id}")
     if lang:
-        lang = lang.get("value")
         if lang == ENG_LANG:
             text = "Sorry, I didn't understand that command."
         elif lang == FA_LANG:
@@ -624,11 +624,7 @@ async def movie_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = ' '.join(context.args)
 
     user = update.effective_chat
-    lang = users_lang_clt.find_one({"key": f"userlang---{user.id}"})
-    if lang:
-        lang = lang.get("value")
-    else:
-        lang = ENG_LANG
+    lang = await find_value(users_lang_clt, f"userlang---{user.id}", ENG_LANG)
 
     en_wait_text = "Please wait. It may take a while"
     fa_wait_text = "لطفا صبر کنید. ممکن است این روند کمی طول بکشد"
@@ -647,7 +643,14 @@ async def movie_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
                                    text=wait_text,
                                    parse_mode=ParseMode.HTML)
 
-    results = TMDB_search_response_bot(message, language=lang)
+    try:
+        results = await TMDB_search_response_bot(message, language=lang)
+    except TMDBUnavailableError:
+        await context.bot.send_message(chat_id=update.effective_chat.id,
+                                       reply_to_message_id=update.message.id,
+                                       text=movie_and_tv_detail_lang['unavailable'][lang])
+        return
+    results = results[:LIST_MAX_RESULTS]
 
     if not results:
         await context.bot.send_message(chat_id=update.effective_chat.id,
@@ -668,29 +671,18 @@ async def movie_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
                                    text=found_text,
                                    parse_mode=ParseMode.HTML)
 
+    # get trailers of all results at once
+    trailers_list = await TMDB_get_trailers_bulk(results, lang)
+
+    # render the captions of all results at once
+    captions = await render_captions(results, lang)
+
     results_message_list = []
-    for i, item in enumerate(results, start=1):
-        if item["poster_path"]:
-            img_url = TMDB_IMG_URL + item['poster_path']
-        _, text = TMDB_MOVIE_or_TV_series_detail(item, item['media_type'], img_url=False, language=lang)
+    for i, (item, text) in enumerate(zip(results, captions), start=1):
+        img = await get_poster(item['poster_path'])
 
-        # get trailers
         media_type = item['media_type']
-        ids = item['id']
-        trailers_filter = {"key": f"trailers---{media_type}---{str(ids)}---{lang}"}
-        trailers = trailers_clt.find_one(trailers_filter)
-        if not trailers:
-            trailers = TMDB_get_trailer(ids, media_type, language=lang)
-            if lang == FA_LANG and not trailers:
-                trailers = TMDB_get_trailer(ids, media_type, language=ENG_LANG)
-            _ = trailers_clt.update_one(
-                    trailers_filter,
-                    {"$set": {"key": f"trailers---{media_type}---{str(ids)}---{lang}",
-                              "value": trailers}},
-                    upsert=True
-            )
-        else:
-            trailers = trailers.get("value")
+        trailers = trailers_list.get((media_type, item['id']), [])
         inline_keyboards = get_inline_keyboard_trailer(trailers,
                                                        media_type,
                                                        item,
@@ -698,21 +690,89 @@ async def movie_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         results_message_list.append((
             f"{i}. {text}",
-            img_url,
+            item.get('poster_path'),
+            img,
             inline_keyboards[::-1]))
 
-    for item, img_url, keyboards in results_message_list:
-        if not img_url:
-            img_url = requests.get(IMDB_IMG_URL, stream=True).content
-        await context.bot.send_photo(
+    if LIST_MEDIA_GROUP:
+        await send_list_media_groups(update, context, results_message_list, lang)
+        return
+
+    for item, poster_path, img, keyboards in results_message_list:
+        message = await context.bot.send_photo(
             chat_id=update.effective_chat.id,
-            photo=img_url,
+            photo=img,
             has_spoiler=True,
             caption=item,
             reply_to_message_id=update.message.id,
             reply_markup=InlineKeyboardMarkup(keyboards),
             parse_mode=ParseMode.HTML,
+            rate_limit_args=BULK,
         )
+        await save_poster(poster_path, img, message)
+
+
+async def send_list_media_groups(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                 results_message_list: list, language=ENG_LANG) -> None:
+    """
+    Send the /list results as albums of up to 10 photos.
+
+    Albums can not have inline keyboards, so the trailer buttons of each album
+    are sent in one message after it, numbered like the captions.
+
+    Args:
+        update (telegram.Update): The incoming update.
+        context (telegram.ext.ContextTypes): The context object.
+        results_message_list (list): The (caption, poster_path, img, keyboards) of each result.
+        language (str, optional): The language of the user. Defaults to ENG_LANG.
+    """
+    size = MediaGroupLimit.MAX_MEDIA_LENGTH
+    for start_index in range(0, len(results_message_list), size):
+        group = results_message_list[start_index:start_index + size]
+
+        # an album needs at least two photos
+        if len(group) < MediaGroupLimit.MIN_MEDIA_LENGTH:
+            item, poster_path, img, keyboards = group[0]
+            message = await context.bot.send_photo(
+                chat_id=update.effective_chat.id,
+                photo=img,
+                has_spoiler=True,
+                caption=item,
+                reply_to_message_id=update.message.id,
+                reply_markup=InlineKeyboardMarkup(keyboards),
+                parse_mode=ParseMode.HTML,
+                rate_limit_args=BULK,
+            )
+            await save_poster(poster_path, img, message)
+            continue
+
+        messages = await context.bot.send_media_group(
+            chat_id=update.effective_chat.id,
+            media=[
+                InputMediaPhoto(media=img, caption=item, parse_mode=ParseMode.HTML, has_spoiler=True)
+                for item, _, img, _ in group
+            ],
+            reply_to_message_id=update.message.id,
+            rate_limit_args=BULK,
+        )
+        for (_, poster_path, img, _), message in zip(group, messages):
+            await save_poster(poster_path, img, message)
+
+        inline_keyboards = []
+        for i, (_, _, _, keyboards) in enumerate(group, start=start_index + 1):
+            for row in keyboards:
+                inline_keyboards.append([
+                    InlineKeyboardButton(text=f"{i}. {button.text}", url=button.url)
+                    for button in row
+                ])
+        if inline_keyboards:
+            await context.bot.send_message(
+                chat_id=update.effective_chat.id,
+                text=movie_and_tv_detail_lang['list_trailers'][language],
+                reply_to_message_id=messages[0].id,
+                reply_markup=InlineKeyboardMarkup(inline_keyboards),
+                rate_limit_args=BULK,
+            )
 
 
 async def movie_bot_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -728,11 +788,7 @@ async def movie_bot_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
         None
     """
     user = update.effective_chat
-    lang = users_lang_clt.find_one({"key": f"userlang---{user.id}"})
-    if lang:
-        lang = lang.get("value")
-    else:
-        lang = ENG_LANG
+    lang = await find_value(users_lang_clt, f"userlang---{user.id}", ENG_LANG)
 
     search_cmd_regex = r"^\/search "
     movie_name = update.message.text
@@ -758,7 +814,13 @@ async def movie_bot_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
                                    reply_to_message_id=update.message.id,
                                    text=wait_text)
 
-    results = TMDB_search_response_bot(movie_name, language=lang)
+    try:
+        results = await TMDB_search_response_bot(movie_name, language=lang)
+    except TMDBUnavailableError:
+        await context.bot.send_message(chat_id=update.effective_chat.id,
+                                       reply_to_message_id=update.message.id,
+                                       text=movie_and_tv_detail_lang['unavailable'][lang])
+        return
     if not results:
         await context.bot.send_message(chat_id=update.effective_chat.id,
                                        reply_to_message_id=update.message.id,
@@ -793,11 +855,13 @@ async def movie_bot_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
             buttons.append([InlineKeyboardButton(item["name"],
                                                  callback_data=callback_data)])
 
-    await context.bot.send_photo(chat_id=update.effective_chat.id,
-                                 photo=IMDB_IMG_URL,
-                                 caption=found_text,
-                                 reply_to_message_id=update.message.id,
-                                 reply_markup=InlineKeyboardMarkup(buttons),)
+    img = await get_poster(None)
+    message = await context.bot.send_photo(chat_id=update.effective_chat.id,
+                                           photo=img,
+                                           caption=found_text,
+                                           reply_to_message_id=update.message.id,
+                                           reply_markup=InlineKeyboardMarkup(buttons),)
+    await save_poster(None, img, message)
 
 
 async def movie_inline_search_callback_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -817,73 +881,68 @@ async def movie_inline_search_callback_query(update: Update, context: ContextTyp
     ids = int(ids)
 
     user = query.from_user
-    lang = users_lang_clt.find_one({"key": f"userlang---{user.id}"})
-    if lang:
-        lang = lang.get("value")
-    else:
-        lang = ENG_LANG
-
-    media_detail_filter = {"key": f"{media_type}---{str(ids)}---{lang}"}
-    if media_type == MOVIE_MEDIA_TYPE:
-        item = media_detail_clt.find_one(media_detail_filter)
-        if not item:
-            item = TMDB_get_movie_additional_detail(ids, detail=True, language=lang)
-            _ = media_detail_clt.update_one(
-                    media_detail_filter,
-                    {"$set": {"key": media_detail_filter,
-                              "value": item}},
-                    upsert=True
-            )
-        else:
-            item = item.get("value")
-        img, caption = TMDB_MOVIE_or_TV_series_detail(item, MOVIE_MEDIA_TYPE, language=lang)
-    elif media_type == TV_MEDIA_TYPE:
-        item = media_detail_clt.find_one(media_detail_filter)
-        if not item:
-            item = TMDB_get_tv_series_additional_detail(ids, detail=True, language=lang)
-            _ = media_detail_clt.update_one(
-                    media_detail_filter,
-                    {"$set": {"key": media_detail_filter,
-                              "value": item}},
-                    upsert=True
-            )
-        else:
-            item = item.get("value")
-        img, caption = TMDB_MOVIE_or_TV_series_detail(item, TV_MEDIA_TYPE, language=lang)
+    lang = await find_value(users_lang_clt, f"userlang---{user.id}", ENG_LANG)
 
-    # get trailers
-    trailers_filter = {"key": f"trailers---{media_type}---{str(ids)}---{lang}"}
-    trailers = trailers_clt.find_one(trailers_filter)
-    if not trailers:
-        trailers = TMDB_get_trailer(ids, media_type, language=lang)
-        if lang == FA_LANG and not trailers:
-            trailers = TMDB_get_trailer(ids, media_type, language=ENG_LANG)
-        _ = trailers_clt.update_one(
-                trailers_filter,
-                {"$set": {"key": f"trailers---{media_type}---{str(ids)}---{lang}",
-                          "value": trailers}},
-                upsert=True
-        )
-    else:
-        trailers = trailers.get("value")
-    inline_keyboards = get_inline_keyboard_trailer(trailers, media_type, item, lang)
-    inline_keyboards = inline_keyboards[::-1]
-
-    if img:
-        await query.edit_message_media(InputMediaPhoto(img,
-                                                       has_spoiler=True))
-    await query.edit_message_caption(caption=caption,
-                                     parse_mode=ParseMode.HTML)
-    if inline_keyboards:
-        await query.edit_message_reply_markup(
-            reply_markup=InlineKeyboardMarkup(
-                inline_keyboards),
-        )
+    card = await get_card(ids, media_type, lang)
+    if not card:
+        await query.answer(text=movie_and_tv_detail_lang['unavailable'][lang],
+                           show_alert=True)
+        return
+    img = card['poster'] or await get_poster(card['poster_path'])
+
+    # the poster, caption and keyboard are edited at once
+    message = await query.edit_message_media(
+        InputMediaPhoto(img,
+                        caption=card['caption'],
+                        parse_mode=ParseMode.HTML,
+                        has_spoiler=True),
+        reply_markup=get_card_markup(card, context.bot),
+    )
+    await save_card_poster(card, ids, media_type, lang, img, message)
 
 
 async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
-    Handle inline queries for the bot.
+    Handle inline queries for the bot, debounced per user.
+
+    Telegram sends an inline query for every keystroke, so the search waits
+    INLINE_QUERY_DEBOUNCE seconds and a newer query of the same user cancels
+    the older one. The handler must be registered with block=False, otherwise
+    the newer query is not processed before the older one is answered.
+
+    Args:
+        update (Update): The update object containing information about the inline query.
+        context (ContextTypes): The context object containing the bot's context.
+
+    Returns:
+        None
+    """
+    user = update.effective_user
+    previous_task = inline_query_tasks.pop(user.id, None)
+    if previous_task:
+        previous_task.cancel()
+
+    # the next pages are asked by Telegram while scrolling, not while typing
+    if not update.inline_query.query or update.inline_query.offset:
+        await answer_inline_query(update, context)
+        return
+
+    task = asyncio.current_task()
+    inline_query_tasks[user.id] = task
+    try:
+        # wait for the user to stop typing
+        await asyncio.sleep(INLINE_QUERY_DEBOUNCE)
+        await answer_inline_query(update, context)
+    except asyncio.CancelledError:
+        logger.debug("Inline query %s was superseded", update.inline_query.id)
+    finally:
+        if inline_query_tasks.get(user.id) is task:
+            del inline_query_tasks[user.id]
+
+
+async def answer_inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Answer an inline query of the bot.
     This is run when you type: @botusername <query>
 
     This function is triggered when a user sends an inline query to the bot. It performs a search based on the query
@@ -902,11 +961,7 @@ async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     name = user.first_name if user.first_name else user.last_name
     user_mention = f"<a href='tg://user?id={user.id}'>{name}</a>"
 
-    lang = users_lang_clt.find_one({"key": f"userlang---{user.id}"})
-    if lang:
-        lang = lang.get("value")
-    else:
-        lang = ENG_LANG
+    lang = await find_value(users_lang_clt, f"userlang---{user.id}", ENG_LANG)
     en_start_text = f"Hi {user_mention}👋. This is <code>IMDB</code> bot!"
     fa_start_text = f"سلام {user_mention}👋. این ربات <code>IMDB</code> است!"
     en_search_text = "Enter Movie Name to Search"
@@ -928,12 +983,28 @@ async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         )
 
     if not movie_name:  # empty query should be handled
-        await update.inline_query.answer(results=[], button=button, cache_time=0)
+        await update.inline_query.answer(results=[],
+                                         button=button,
+                                         cache_time=INLINE_CACHE_TIMES["empty"],
+                                         is_personal=True)
+        return
 
-    results = TMDB_search_response_bot(movie_name, ENG_LANG)
+    # offset format: "TMDB_page:index_in_page", each answer has INLINE_PAGE_SIZE results
+    offset = update.inline_query.offset
+    page, index = map(int, offset.split(':')) if offset else (1, 0)
+
+    # the details are fetched when a result is chosen, see inline_chosen_result
+    response = await TMDB_search_response_lite(movie_name, ENG_LANG, page)
+    results = response["results"][index:index + INLINE_PAGE_SIZE]
+    if index + INLINE_PAGE_SIZE < len(response["results"]):
+        next_offset = f"{page}:{index + INLINE_PAGE_SIZE}"
+    elif page < response["total_pages"]:
+        next_offset = f"{page + 1}:0"
+    else:
+        next_offset = ""
 
-    en_found_text = f"IMDB: Found {len(results)} Results for '{movie_name}'"
-    fa_found_text = f"آی‌ام‌دی‌بی: {len(results)} نتیجه برای '{movie_name}' پیدا شد"
+    en_found_text = f"IMDB: Found {response['total_results']} Results for '{movie_name}'"
+    fa_found_text = f"آی‌ام‌دی‌بی: {response['total_results']} نتیجه برای '{movie_name}' پیدا شد"
     en_not_found_text = f"IMDB: Found 0 Results for '{movie_name}'"
     fa_not_found_text = f"آی‌ام‌دی‌بی: هیچ نتیجه‌ای برای '{movie_name}' پیدا نشد"
     en_search_title = "Enter a movie name to search IMDB"
@@ -959,13 +1030,14 @@ async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         inline_text = fa_inline_text
         opn = fa_open
 
-    if results:
+    if results or offset:
         button = InlineQueryResultsButton(
             text=found_text,
             start_parameter="start"
         )
-        inline_results = [
-            InlineQueryResultArticle(
+        inline_results = []
+        if not offset:
+            inline_results.append(InlineQueryResultArticle(
                 id="start",
                 title=search_title,
                 input_message_content=InputTextMessageContent(
@@ -977,8 +1049,7 @@ async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
                         text=inline_text,
                         switch_inline_query_current_chat="",)]]
                 ),
-            ),
-        ]
+            ))
         for item in results:
             if item["media_type"] == MOVIE_MEDIA_TYPE:
                 if item['imdb_id']:
@@ -1050,7 +1121,11 @@ async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
                             text=inline_ketboard_text,
                             url=inline_ketboard_url)]])))
         try:
-            await update.inline_query.answer(inline_results, button=button, cache_time=0)
+            await update.inline_query.answer(inline_results,
+                                             button=button,
+                                             cache_time=INLINE_CACHE_TIMES["results"],
+                                             is_personal=True,
+                                             next_offset=next_offset)
         except BadRequest as e:
             # Ignore the "Query is too old" error
             if "Query is too old" in str(e):
@@ -1062,7 +1137,10 @@ async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             text=not_found_text,
             start_parameter="start"
         )
-        await update.inline_query.answer(results=[], button=button, cache_time=0)
+        await update.inline_query.answer(results=[],
+                                         button=button,
+                                         cache_time=INLINE_CACHE_TIMES["not_found"],
+                                         is_personal=True)
 
 
 async def inline_chosen_result(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1081,11 +1159,7 @@ async def inline_chosen_result(update: Update, context: ContextTypes.DEFAULT_TYP
     """
     chosen_inline_result = update.chosen_inline_result
     user = update.chosen_inline_result.from_user
-    lang = users_lang_clt.find_one({"key": f"userlang---{user.id}"})
-    if lang:
-        lang = lang.get("value")
-    else:
-        lang = ENG_LANG
+    lang = await find_value(users_lang_clt, f"userlang---{user.id}", ENG_LANG)
 
     # get the deatil of movie by request and showing them
     if chosen_inline_result.result_id == "start":
@@ -1131,64 +1205,31 @@ Search InLine by clicking on the below buttons"""
         return
 
     media_type, ids = chosen_inline_result.result_id.split('-')
-    media_detail_filter = {"key": f"{media_type}---{str(ids)}---{lang}"}
-    if media_type == MOVIE_MEDIA_TYPE:
-        item = media_detail_clt.find_one(media_detail_filter)
-        if not item:
-            item = TMDB_get_movie_additional_detail(ids, detail=True, language=lang)
-            _ = media_detail_clt.update_one(
-                        media_detail_filter,
-                        {"$set": {"key": media_detail_filter,
-                                  "value": item}},
-                        upsert=True
-            )
-        else:
-            item.get("value")
-        img, caption = TMDB_MOVIE_or_TV_series_detail(item, MOVIE_MEDIA_TYPE, language=lang)
-    elif media_type == TV_MEDIA_TYPE:
-        item = media_detail_clt.find_one(media_detail_filter)
-        if not item:
-            item = TMDB_get_tv_series_additional_detail(ids, detail=True, language=lang)
-            _ = media_detail_clt.update_one(
-                        media_detail_filter,
-                        {"$set": {"key": media_detail_filter,
-                                  "value": item}},
-                        upsert=True
+    card = await get_card(ids, media_type, lang)
+    if not card:
+        if chosen_inline_result.inline_message_id:
+            await context.bot.edit_message_caption(
+                inline_message_id=chosen_inline_result.inline_message_id,
+                caption=movie_and_tv_detail_lang['unavailable'][lang],
             )
-        else:
-            item = item.get("value")
-        img, caption = TMDB_MOVIE_or_TV_series_detail(item, TV_MEDIA_TYPE, language=lang)
-
-    if not img:
-        img = requests.get(IMDB_IMG_URL, stream=True).content
-
-    # get trailers
-    trailers_filter = {"key": f"trailers---{media_type}---{str(ids)}---{lang}"}
-    trailers = trailers_clt.find_one(trailers_filter)
-    if not trailers:
-        trailers = TMDB_get_trailer(ids, media_type, language=lang)
-        if lang == FA_LANG and not trailers:
-            trailers = TMDB_get_trailer(ids, media_type, language=ENG_LANG)
-        _ = trailers_clt.update_one(
-                trailers_filter,
-                {"$set": {"key": f"trailers---{media_type}---{str(ids)}---{lang}",
-                          "value": trailers}},
-                upsert=True
-        )
-    else:
-        trailers = trailers.get("value")
-    inline_keyboards = get_inline_keyboard_trailer(trailers, media_type, item, lang)
-    inline_keyboards = inline_keyboards[::-1]
+        return
 
     if update.chosen_inline_result.inline_message_id:
         inline_message_id = chosen_inline_result.inline_message_id
+        img = card['poster'] or await get_poster(card['poster_path'])
+        reply_markup = get_card_markup(card, context.bot)
+        # the poster, caption and keyboard are edited at once
         try:
             await context.bot.edit_message_media(
                 inline_message_id=inline_message_id,
                 media=InputMediaPhoto(
                     media=img,
+                    caption=card['caption'],
+                    parse_mode=ParseMode.HTML,
                     has_spoiler=True,),
+                reply_markup=reply_markup,
             )
+            return
         except BadRequest as e:
             if "Invalid message content specified" in str(e):
                 pass
@@ -1196,20 +1237,84 @@ Search InLine by clicking on the below buttons"""
                 logger.error("BadRequest error: %s", e)
         await context.bot.edit_message_caption(
             inline_message_id=inline_message_id,
-            caption=caption,
-            parse_mode=ParseMode.HTML
+            caption=card['caption'],
+            parse_mode=ParseMode.HTML,
+            reply_markup=reply_markup,
         )
-        if inline_keyboards:
-            await context.bot.edit_message_reply_markup(
-                inline_message_id=inline_message_id,
-                reply_markup=InlineKeyboardMarkup(
-                    inline_keyboards),
-            )
+
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Send the runtime statistics of the bot to the developer.
+
+    Args:
+        update (telegram.Update): The incoming update.
+        context (telegram.ext.ContextTypes.Context): The context object for the handler.
+
+    Returns:
+        None
+    """
+    bot_stats = {
+        "http_pool": get_http_pool_stats(),
+        "tmdb": get_tmdb_stats(),
+        "caches": get_cache_stats(),
+        "media_flight": media_flight.stats(),
+        "captions": caption_cache.stats(),
+        "telegram": context.bot.rate_limiter.stats() if context.bot.rate_limiter else None,
+        "updates": {
+            **context.application.update_processor.stats(),
+            "update_queue": context.application.update_queue.qsize(),
+        },
+    }
+    text = f"<pre>{html.escape(json.dumps(bot_stats, indent=2))}</pre>"
+    await context.bot.send_message(chat_id=update.effective_chat.id,
+                                   text=text,
+                                   parse_mode=ParseMode.HTML)
+
+
+async def post_init(application):
+    """
+    Open the shared resources of the bot before it starts receiving updates.
+
+    Args:
+        application (telegram.ext.Application): The bot application.
+    """
+    global fallback_poster
+
+    await init_db()
+    await init_http_client()
+    init_render_pool()
+    # Telegram downloads the logo itself if it could not be loaded
+    fallback_poster = await download_image(IMDB_IMG_URL) or IMDB_IMG_URL
+
+
+async def post_shutdown(application):
+    """
+    Close the shared resources of the bot after it stops.
+
+    Args:
+        application (telegram.ext.Application): The bot application.
+    """
+    logger.info("HTTP pool stats: %s", get_http_pool_stats())
+    await close_http_client()
+    close_render_pool()
 
 
 if __name__ == "__main__":
     # Build the Telegram bot application
-    application = ApplicationBuilder().token(token=TOKEN).build()
+    application = (
+        ApplicationBuilder()
+        .token(token=TOKEN)
+        .concurrent_updates(ChatOrderedUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .rate_limiter(TelegramRateLimiter(overall_rate=TELEGRAM_OVERALL_RATE,
+                                          chat_rate=TELEGRAM_CHAT_RATE,
+                                          chat_burst=TELEGRAM_CHAT_BURST,
+                                          group_rate=TELEGRAM_GROUP_RATE,
+                                          max_retries=TELEGRAM_MAX_RETRIES))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # Define command handlers
     start_handler = CommandHandler("start", start)
@@ -1217,6 +1322,8 @@ if __name__ == "__main__":
     help_handler = CommandHandler("help", help)
     search_handler = CommandHandler("search", movie_bot_search)
     movie_list_handler = CommandHandler("list", movie_list)
+    stats_handler = CommandHandler("stats", stats,
+                                   filters=filters.Chat(chat_id=DEVELOPER_CHAT_ID))
 
     # Define message handlers
     movie_list_inline_search_handler = MessageHandler(
@@ -1232,7 +1339,7 @@ if __name__ == "__main__":
     )
 
     # Define inline query handler
-    inline_query_handler = InlineQueryHandler(inline_query)
+    inline_query_handler = InlineQueryHandler(inline_query, block=False)
 
     # Define chosen inline result handler
     inline_chosen_result_handler = ChosenInlineResultHandler(
@@ -1247,6 +1354,7 @@ if __name__ == "__main__":
     application.add_handler(help_handler)
     application.add_handler(search_handler)
     application.add_handler(movie_list_handler)
+    application.add_handler(stats_handler)
     application.add_handler(movie_list_inline_search_handler)
     application.add_handler(movie_inline_search_callback_query_handler)
     application.add_handler(language_callback_query_handler)
@@ -1256,4 +1364,17 @@ if __name__ == "__main__":
     application.add_error_handler(error_handler)
 
     # Start the bot application
-    application.run_polling()
+    if BOT_MODE == "webhook":
+        # the application was built on this loop, like run_polling it must run on it
+        asyncio.get_event_loop().run_until_complete(run_webhook(application,
+                                                                url=WEBHOOK_URL,
+                                                                listen=WEBHOOK_LISTEN,
+                                                                port=WEBHOOK_PORT,
+                                                                path=WEBHOOK_PATH,
+                                                                secret_token=WEBHOOK_SECRET_TOKEN,
+                                                                replica_urls=WEBHOOK_REPLICA_URLS,
+                                                                replica_index=WEBHOOK_REPLICA_INDEX,
+                                                                health_listen=HEALTH_LISTEN,
+                                                                health_port=HEALTH_PORT))
+    else:
+        application.run_polling()
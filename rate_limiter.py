@@ -0,0 +1,138 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from cache import TTLCache
+from resilience import TokenBucket
+
+
+logger = logging.getLogger(__name__)
+
+# the priorities of the requests, lower is sent first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+BULK = {"priority": PRIORITY_BULK}
+
+
+class TelegramRateLimiter(BaseRateLimiter):
+    """
+    Throttles the requests to the Telegram Bot API, so the flood limits are not hit.
+
+    Every request takes a token of the global bucket, and the requests to a chat also
+    take a token of the bucket of that chat. The requests waiting for the global bucket
+    are sent by priority, so replies to users go before bulk output like the /list results,
+    which is sent with rate_limit_args=BULK. A RetryAfter error pauses every request and
+    the request is sent again.
+    """
+
+    def __init__(self, overall_rate=30, chat_rate=1, chat_burst=3, group_rate=20 / 60, max_retries=3):
+        """
+        Args:
+            overall_rate (float, optional): The requests per second to all chats. Defaults to 30.
+            chat_rate (float, optional): The requests per second to a private chat. Defaults to 1.
+            chat_burst (int, optional): The allowed burst of requests to a chat. Defaults to 3.
+            group_rate (float, optional): The requests per second to a group. Defaults to 20 per minute.
+            max_retries (int, optional): The number of retries after a RetryAfter error. Defaults to 3.
+        """
+        self.overall_rate = overall_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.requests = 0
+        self.retried = 0
+        self._bucket = TokenBucket(overall_rate, overall_rate)
+        # the buckets of the idle chats are full again after a minute, so they can be dropped
+        self._chat_buckets = TTLCache(maxsize=10000, ttl=60)
+        self._queue = []
+        self._counter = itertools.count()
+        self._changed = None
+        self._paused_until = 0
+
+    async def initialize(self):
+        self._changed = asyncio.Event()
+
+    async def shutdown(self):
+        self._queue.clear()
+        self._chat_buckets.clear()
+
+    def _get_chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # the ids of groups and channels are negative
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.chat_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets.set(chat_id, bucket)
+        return bucket
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _acquire(self, priority):
+        """
+        Waits for a token of the global bucket, the waiting request with the lowest
+        priority number takes the next token.
+        """
+        if self._changed is None:
+            self._changed = asyncio.Event()
+
+        entry = (priority, next(self._counter))
+        heapq.heappush(self._queue, entry)
+        try:
+            while True:
+                if self._queue[0] != entry:
+                    await self._changed.wait()
+                    continue
+
+                delay = self._paused_until - time.monotonic()
+                if delay <= 0:
+                    delay = self._bucket.try_acquire()
+                if delay <= 0:
+                    return
+                await asyncio.sleep(delay)
+        finally:
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+            self._notify()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = (rate_limit_args or {}).get("priority", PRIORITY_INTERACTIVE)
+        chat_id = data.get("chat_id")
+        self.requests += 1
+
+        for attempt in range(self.max_retries + 1):
+            if chat_id is not None:
+                await self._get_chat_bucket(chat_id).acquire()
+            await self._acquire(priority)
+
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as error:
+                if attempt == self.max_retries:
+                    raise
+                self.retried += 1
+                retry_after = error.retry_after
+                logger.warning("Telegram flood control on %s, retrying in %s seconds", endpoint, retry_after)
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                await asyncio.sleep(retry_after)
+
+    def stats(self):
+        """
+        Returns the state of the rate limiter.
+
+        Returns:
+            dict: The number of requests, retried and waiting requests and the global bucket.
+        """
+        return {
+            "requests": self.requests,
+            "retried": self.retried,
+            "waiting": len(self._queue),
+            "chats": len(self._chat_buckets),
+            "bucket": self._bucket.stats(),
+        }
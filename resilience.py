@@ -0,0 +1,188 @@
+import asyncio
+import random
+import time
+
+
+class TokenBucket:
+    """
+    A token bucket rate limiter, callers wait until a token is available.
+    """
+
+    def __init__(self, rate, capacity):
+        """
+        Args:
+            rate (float): The number of tokens added per second.
+            capacity (int): The maximum number of tokens, i.e. the allowed burst.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.waits = 0
+        self._updated_at = time.monotonic()
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self):
+        """
+        Takes one token, waiting for it if the bucket is empty.
+        """
+        # created here so the lock belongs to the running event loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                self.waits += 1
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+    def try_acquire(self):
+        """
+        Takes one token if one is available, without waiting.
+
+        Returns:
+            float: 0 if a token was taken, otherwise the seconds until one is available.
+        """
+        self._refill()
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        self.tokens -= 1
+        return 0
+
+    def stats(self):
+        """
+        Returns the state of the bucket.
+
+        Returns:
+            dict: The available tokens and the number of times a caller had to wait.
+        """
+        self._refill()
+        return {
+            "tokens": round(self.tokens, 2),
+            "capacity": self.capacity,
+            "rate": self.rate,
+            "waits": self.waits,
+        }
+
+
+def backoff_delay(attempt, base=0.5, maximum=30.0):
+    """
+    Returns a jittered exponential backoff delay.
+
+    Args:
+        attempt (int): The number of the retry, starting from 0.
+        base (float, optional): The delay of the first retry in seconds. Defaults to 0.5.
+        maximum (float, optional): The maximum delay in seconds. Defaults to 30.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    A circuit breaker, it opens after too many consecutive failed or slow calls,
+    so the callers stop waiting for a service which is down. After reset_timeout
+    seconds one trial call is allowed, and its result closes or reopens the circuit.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=5, slow_call_duration=3.0, reset_timeout=30.0):
+        """
+        Args:
+            failure_threshold (int, optional): The number of consecutive failures which opens
+                the circuit. Defaults to 5.
+            slow_call_duration (float, optional): Calls slower than this number of seconds count
+                as failures. Defaults to 3.
+            reset_timeout (float, optional): The number of seconds the circuit stays open.
+                Defaults to 30.
+        """
+        self.failure_threshold = failure_threshold
+        self.slow_call_duration = slow_call_duration
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = 0
+        self.rejected_calls = 0
+        self._state = self.CLOSED
+        self._opened_at = 0
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = False
+        return self._state
+
+    def allow(self):
+        """
+        Checks if a call may be sent, in the half-open state only one trial call is allowed.
+
+        Returns:
+            bool: True if the call may be sent.
+        """
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+
+        self.rejected_calls += 1
+        return False
+
+    def record_success(self, duration=0):
+        """
+        Records a finished call, it counts as a failure if it was slower than slow_call_duration.
+
+        Args:
+            duration (float, optional): The duration of the call in seconds. Defaults to 0.
+        """
+        if duration > self.slow_call_duration:
+            self.record_failure()
+            return
+        self.failures = 0
+        self._state = self.CLOSED
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        """
+        Records a failed call and opens the circuit if needed.
+        """
+        self.failures += 1
+        if self._state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self._state != self.OPEN:
+                self.opened += 1
+            self._state = self.OPEN
+            self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """
+        Frees the trial call of the half-open state, for a call which ended without
+        a result, e.g. it was cancelled, so the next call can be the trial.
+        """
+        self._trial_in_flight = False
+
+    def stats(self):
+        """
+        Returns the state of the circuit breaker.
+
+        Returns:
+            dict: The state, the consecutive failures and the number of opened circuits and rejected calls.
+        """
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "opened": self.opened,
+            "rejected_calls": self.rejected_calls,
+        }
@@ -0,0 +1,96 @@
+import decouple
+from datetime import datetime, timedelta, timezone
+from cache import TTLCache
+from db import COLLECTION_TTLS, flow_state_clt
+
+
+# "mongo" shares the state between the replicas of the bot, "memory" keeps it in the process
+STATE_BACKEND = decouple.config("STATE_BACKEND", default="mongo")
+FLOW_STATE_TTL = COLLECTION_TTLS["flow_state"][1]
+
+
+class MemoryStateStore:
+    """
+    Keeps the state of the conversations in the process, for tests and a single replica.
+    """
+
+    def __init__(self, ttl=3600, maxsize=10000):
+        """
+        Args:
+            ttl (float, optional): The lifetime of a value in seconds. Defaults to 3600.
+            maxsize (int, optional): The maximum number of values. Defaults to 10000.
+        """
+        self._cache = TTLCache(maxsize, ttl)
+
+    async def get(self, key, default=None):
+        return self._cache.get(key, default)
+
+    async def set(self, key, value):
+        self._cache.set(key, value)
+
+    async def pop(self, key, default=None):
+        value = self._cache.get(key, default)
+        self._cache.delete(key)
+        return value
+
+
+class MongoStateStore:
+    """
+    Keeps the state of the conversations in a Mongo collection, so every replica of the bot
+    sees it. The values expire after ttl seconds, Mongo deletes them with the TTL index.
+    """
+
+    def __init__(self, collection, ttl=3600):
+        """
+        Args:
+            collection (motor.motor_asyncio.AsyncIOMotorCollection): The collection of the state.
+            ttl (float, optional): The lifetime of a value in seconds. Defaults to 3600.
+        """
+        self.collection = collection
+        self.ttl = ttl
+
+    async def get(self, key, default=None):
+        # the TTL monitor of Mongo runs once a minute, so expired documents may still exist
+        now = datetime.now(timezone.utc)
+        document = await self.collection.find_one({"key": key, "expires_at": {"$gt": now}})
+        if document is None:
+            return default
+        return document["value"]
+
+    async def set(self, key, value):
+        now = datetime.now(timezone.utc)
+        await self.collection.update_one(
+            {"key": key},
+            {"$set": {"key": key,
+                      "value": value,
+                      "updated_at": now,
+                      "expires_at": now + timedelta(seconds=self.ttl)}},
+            upsert=True,
+        )
+
+    async def pop(self, key, default=None):
+        document = await self.collection.find_one_and_delete({"key": key})
+        if document is None or document["expires_at"] <= datetime.now(timezone.utc):
+            return default
+        return document["value"]
+
+
+def create_state_store(backend=STATE_BACKEND):
+    """
+    Creates the store of the conversation state.
+
+    Args:
+        backend (str, optional): "mongo" or "memory". Defaults to STATE_BACKEND.
+
+    Returns:
+        MongoStateStore or MemoryStateStore: The store.
+    """
+    if backend == "memory":
+        return MemoryStateStore(FLOW_STATE_TTL)
+    if backend == "mongo":
+        return MongoStateStore(flow_state_clt, FLOW_STATE_TTL)
+    raise ValueError(f"Unknown state backend: {backend}")
+
+
+# the per-user state of the /start and /language flows, see main.py
+flow_state = create_state_store()
@@ -0,0 +1,9 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# the modules read these settings when they are imported
+os.environ.setdefault("TOKEN", "1")
+os.environ.setdefault("DEVELOPER_CHAT_ID", "1")
+os.environ.setdefault("TMBD_API_KEY", "test")
+os.environ.setdefault("TMBD_API_READ_ACCESS_TOKEN", "test")
@@ -0,0 +1,152 @@
+import asyncio
+import httpx
+import pytest
+import api
+
+
+def test_search_raises_while_tmdb_is_unavailable(monkeypatch):
+    async def unavailable(phrase, language="en-US", page=1):
+        raise api.TMDBUnavailableError(phrase)
+
+    monkeypatch.setattr(api, "TMDB_search_by_phrase", unavailable)
+
+    with pytest.raises(api.TMDBUnavailableError):
+        asyncio.run(api.TMDB_search_response_bot("inception"))
+
+
+def test_search_raises_if_no_result_can_be_fetched(monkeypatch):
+    async def search(phrase, language="en-US", page=1):
+        return {"results": [{"id": 1, "media_type": api.MOVIE_MEDIA_TYPE}]}
+
+    async def not_cached(collection, key, default=None):
+        return default, False
+
+    async def unavailable(ids, media_type, language="en-US"):
+        raise api.TMDBUnavailableError(ids)
+
+    monkeypatch.setattr(api, "TMDB_search_by_phrase", search)
+    monkeypatch.setattr(api, "find_entry", not_cached)
+    monkeypatch.setattr(api, "TMDB_fetch_media", unavailable)
+
+    with pytest.raises(api.TMDBUnavailableError):
+        asyncio.run(api.TMDB_search_response_bot("inception"))
+
+
+def test_search_leaves_out_results_without_details(monkeypatch):
+    async def search(phrase, language="en-US", page=1):
+        return {"results": [{"id": 1, "media_type": api.TV_MEDIA_TYPE}]}
+
+    async def not_cached(collection, key, default=None):
+        return default, False
+
+    async def not_parsed(ids, media_type, language="en-US"):
+        return {}, {}, []
+
+    monkeypatch.setattr(api, "TMDB_search_by_phrase", search)
+    monkeypatch.setattr(api, "find_entry", not_cached)
+    monkeypatch.setattr(api, "TMDB_fetch_media", not_parsed)
+
+    assert asyncio.run(api.TMDB_search_response_bot("inception")) == []
+
+
+def test_search_without_results_is_not_found(monkeypatch):
+    async def search(phrase, language="en-US", page=1):
+        return {"results": [{"id": 1, "media_type": "person"}]}
+
+    monkeypatch.setattr(api, "TMDB_search_by_phrase", search)
+
+    assert asyncio.run(api.TMDB_search_response_bot("inception")) == []
+
+
+def test_stale_bulk_trailers_are_refreshed(monkeypatch):
+    stale_key = "trailers---movie---1---en-US"
+    fresh_key = "trailers---tv---2---en-US"
+
+    async def find_values(collection, keys):
+        return {stale_key: (["stale"], True), fresh_key: (["fresh"], False)}
+
+    refreshed = []
+    monkeypatch.setattr(api, "find_values", find_values)
+    monkeypatch.setattr(api, "TMDB_refresh_media", lambda ids, media_type, language: refreshed.append((media_type, ids)))
+
+    items = [{"media_type": "movie", "id": 1}, {"media_type": "tv", "id": 2}]
+    trailers = asyncio.run(api.TMDB_get_trailers_bulk(items))
+
+    assert trailers == {("movie", 1): ["stale"], ("tv", 2): ["fresh"]}
+    assert refreshed == [("movie", 1)]
+
+
+def test_unaired_tv_series_is_parsed():
+    response = {
+        "genres": [{"name": "Drama"}],
+        "spoken_languages": [{"english_name": "English"}],
+        "first_air_date": None,
+        "last_air_date": None,
+    }
+    credits = {"casts": [], "directors": [], "writers": []}
+
+    detail = api.TMDB_parse_additional_detail(response, credits, api.TV_MEDIA_TYPE)
+
+    assert detail["year1"] == ""
+    assert detail["year2"] == ""
+    assert detail["genres"] == ["Drama"]
+
+
+def test_unreleased_movie_is_parsed():
+    response = {"genres": [], "spoken_languages": [], "imdb_id": None, "release_date": None}
+    credits = {"casts": [], "directors": [], "writers": []}
+
+    detail = api.TMDB_parse_additional_detail(response, credits, api.MOVIE_MEDIA_TYPE)
+
+    assert detail["imdb_id"] == ""
+    assert detail["year"] == ""
+
+
+def test_malformed_payload_is_not_parsed():
+    credits = {"casts": [], "directors": [], "writers": []}
+
+    assert api.TMDB_parse_additional_detail({"genres": None}, credits, api.MOVIE_MEDIA_TYPE) == {}
+
+
+def test_failed_bulk_trailers_are_not_stored(monkeypatch):
+    async def find_values(collection, keys):
+        return {}
+
+    async def failed(url):
+        return httpx.Response(404)
+
+    saved = {}
+    invalidated = []
+
+    async def save_values(collection, values):
+        saved.update(values)
+
+    async def invalidate_cards(medias, language="en-US"):
+        invalidated.extend(medias)
+
+    monkeypatch.setattr(api, "find_values", find_values)
+    monkeypatch.setattr(api, "TMDB_get", failed)
+    monkeypatch.setattr(api, "save_values", save_values)
+    monkeypatch.setattr(api, "invalidate_cards", invalidate_cards)
+
+    trailers = asyncio.run(api.TMDB_get_trailers_bulk([{"media_type": "movie", "id": 1}]))
+
+    assert trailers == {}
+    assert saved == {}
+    assert invalidated == []
+
+
+def test_long_retry_after_is_not_waited_for(monkeypatch):
+    requests = []
+
+    class Client:
+        async def get(self, url, headers=None):
+            requests.append(url)
+            return httpx.Response(429, headers={"Retry-After": "3600"})
+
+    monkeypatch.setattr(api, "get_http_client", Client)
+
+    response = asyncio.run(api.TMDB_get("https://api.themoviedb.org/3/movie/1"))
+
+    assert response.status_code == 429
+    assert len(requests) == 1
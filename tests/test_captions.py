@@ -0,0 +1,36 @@
+import asyncio
+import captions
+
+
+def make_tv_item(**fields):
+    item = {
+        "id": 1,
+        "media_type": "tv",
+        "poster_path": "",
+        "name": "Dark",
+        "year1": "2017",
+        "year2": "2020",
+        "first_air_date": "2017-12-01",
+        "languages": [],
+        "genres": [],
+        "overview": "",
+        "directors": [],
+        "writers": [],
+        "casts": [],
+        "cache_version": 1,
+    }
+    item.update(fields)
+    return item
+
+
+def test_list_and_detail_captions_are_cached_apart():
+    captions.caption_cache.clear()
+    # a search result has no last air date, the full details have one
+    search_item = make_tv_item()
+    detail_item = make_tv_item(last_air_date="2020-06-27")
+
+    list_caption, = asyncio.run(captions.render_captions([search_item], captions.ENG_LANG))
+    detail_caption = captions.get_caption(detail_item, "tv", captions.ENG_LANG)
+
+    assert "2020-06-27" not in list_caption
+    assert "2017-12-01 to 2020-06-27" in detail_caption
@@ -0,0 +1,39 @@
+import asyncio
+import api
+from resilience import CircuitBreaker
+
+
+def test_half_open_breaker_allows_one_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_cancelled_trial_releases_the_half_open_breaker(monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    monkeypatch.setattr(api, "tmdb_circuit_breaker", breaker)
+
+    class HangingClient:
+        async def get(self, url, headers=None):
+            await asyncio.sleep(3600)
+
+    monkeypatch.setattr(api, "get_http_client", lambda: HangingClient())
+
+    async def cancel_trial():
+        task = asyncio.create_task(api.TMDB_get("https://api.themoviedb.org/3/movie/1"))
+        await asyncio.sleep(0.01)
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(cancel_trial())
+
+    assert breaker.allow()
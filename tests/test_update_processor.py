@@ -0,0 +1,78 @@
+import asyncio
+from telegram import Update
+from update_processor import ChatOrderedUpdateProcessor
+
+
+def make_update(update_id, chat_id):
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+            "text": "/start",
+        },
+    }, None)
+
+
+async def process(processor, updates):
+    """
+    Processes (update, name, duration) jobs like the Application does, one task per update.
+    """
+    events = []
+    running = []
+    max_running = 0
+
+    async def handle(name, duration):
+        nonlocal max_running
+        running.append(name)
+        max_running = max(max_running, len(running))
+        events.append(("start", name))
+        await asyncio.sleep(duration)
+        events.append(("end", name))
+        running.remove(name)
+
+    async with processor:
+        await asyncio.gather(*(
+            processor.process_update(update, handle(name, duration))
+            for update, name, duration in updates
+        ))
+    return events, max_running
+
+
+def test_updates_of_a_chat_are_processed_in_order():
+    processor = ChatOrderedUpdateProcessor(10)
+    updates = [
+        (make_update(1, 1), "a1", 0.05),
+        (make_update(2, 1), "a2", 0.01),
+        (make_update(3, 2), "b1", 0.01),
+    ]
+
+    events, _ = asyncio.run(process(processor, updates))
+
+    assert events.index(("end", "a1")) < events.index(("start", "a2"))
+    # the other chat does not wait for the first one
+    assert events.index(("end", "b1")) < events.index(("end", "a1"))
+
+
+def test_concurrency_is_limited():
+    processor = ChatOrderedUpdateProcessor(2)
+    updates = [(make_update(i, i), f"u{i}", 0.01) for i in range(6)]
+
+    events, max_running = asyncio.run(process(processor, updates))
+
+    assert max_running == 2
+    assert len(events) == 12
+    assert processor.stats()["processed"] == 6
+    assert processor.stats()["waiting"] == 0
+
+
+def test_busy_chat_does_not_hold_the_slots():
+    processor = ChatOrderedUpdateProcessor(2)
+    # the queued updates of chat 1 must not keep chat 2 waiting
+    updates = [(make_update(i, 1), f"a{i}", 0.02) for i in range(4)]
+    updates.append((make_update(10, 2), "b", 0.01))
+
+    events, _ = asyncio.run(process(processor, updates))
+
+    assert events.index(("end", "b")) < events.index(("start", "a1"))
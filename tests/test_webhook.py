@@ -0,0 +1,76 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+from starlette.testclient import TestClient
+from telegram import Update
+from webhook import SECRET_TOKEN_HEADER, create_health_app, create_webhook_app, get_partition, run_webhook
+
+SECRET = "secret"
+
+
+def create_client():
+    application = SimpleNamespace(bot=None, update_queue=asyncio.Queue(), running=True)
+    return application, TestClient(create_webhook_app(application, "/telegram", SECRET))
+
+
+def test_update_without_secret_token_is_rejected():
+    application, client = create_client()
+
+    response = client.post("/telegram", json={"update_id": 1})
+
+    assert response.status_code == 403
+    assert application.update_queue.empty()
+
+
+@pytest.mark.parametrize("body", [b"not json", b"[1, 2]", b"1", b"null", b"{}"])
+def test_body_which_is_not_an_update_is_rejected(body):
+    application, client = create_client()
+
+    response = client.post("/telegram", content=body, headers={SECRET_TOKEN_HEADER: SECRET})
+
+    assert response.status_code == 400
+    assert application.update_queue.empty()
+
+
+def test_update_is_queued():
+    application, client = create_client()
+
+    response = client.post("/telegram", json={"update_id": 1}, headers={SECRET_TOKEN_HEADER: SECRET})
+
+    assert response.status_code == 200
+    assert application.update_queue.qsize() == 1
+
+
+@pytest.mark.parametrize("secret_token", [None, ""])
+def test_webhook_does_not_start_without_secret_token(secret_token):
+    with pytest.raises(ValueError):
+        asyncio.run(run_webhook(None, "https://example.com", secret_token))
+
+
+def test_updates_are_partitioned_by_chat():
+    user = {"id": 7, "is_bot": False, "first_name": "a"}
+    group_message = Update.de_json({"update_id": 1, "message": {
+        "message_id": 1, "date": 0, "chat": {"id": -100, "type": "group"}, "from": user}}, None)
+    private_message = Update.de_json({"update_id": 2, "message": {
+        "message_id": 1, "date": 0, "chat": {"id": 7, "type": "private"}, "from": user}}, None)
+    inline_query = Update.de_json({"update_id": 3, "inline_query": {
+        "id": "1", "from": user, "query": "", "offset": ""}}, None)
+
+    assert get_partition(group_message, 3) == -100 % 3
+    assert get_partition(private_message, 3) == get_partition(inline_query, 3) == 7 % 3
+
+
+def test_health_is_not_served_on_the_webhook_listener():
+    _, client = create_client()
+
+    assert client.get("/healthz").status_code == 404
+
+
+def test_health_is_reported():
+    application = SimpleNamespace(update_queue=asyncio.Queue(), running=True)
+    client = TestClient(create_health_app(application))
+
+    assert client.get("/healthz").json() == {"status": "ok", "update_queue": 0}
+
+    application.running = False
+    assert client.get("/healthz").status_code == 503
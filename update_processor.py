@@ -0,0 +1,110 @@
+import asyncio
+import sys
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes the updates concurrently, at most max_concurrent_updates at a time,
+    while the updates of the same chat are processed one by one in the order they came.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        """
+        Args:
+            max_concurrent_updates (int): The maximum number of updates processed at the same time.
+        """
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        # the semaphore of the base class is taken before do_process_update, where an update
+        # may still wait for its chat, so it is left unbounded and the limit is enforced by _slots
+        # after the chat lock, and the waiting updates of a busy chat do not hold the slots the
+        # other chats could use
+        super().__init__(sys.maxsize)
+        self._limit = max_concurrent_updates
+        self._slots = None
+        self.waiting = 0
+        self.max_waiting = 0
+        self.processing = 0
+        self.processed = 0
+        # the lock of each chat with an update in progress and the number of its updates
+        self._chat_locks = {}
+
+    @staticmethod
+    def get_chat_key(update):
+        """
+        Get the key the updates are ordered by, None for updates which need no order.
+        """
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat:
+            return update.effective_chat.id
+        if update.effective_user:
+            return update.effective_user.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self.get_chat_key(update)
+        if key is None:
+            await self._process(coroutine)
+            return
+
+        entry = self._chat_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            await self._process(coroutine, entry[0])
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chat_locks[key]
+
+    async def _process(self, coroutine, chat_lock=None):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._limit)
+
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        started = False
+        try:
+            if chat_lock:
+                await chat_lock.acquire()
+            try:
+                async with self._slots:
+                    self.waiting -= 1
+                    started = True
+                    self.processing += 1
+                    try:
+                        await coroutine
+                    finally:
+                        self.processing -= 1
+                        self.processed += 1
+            finally:
+                if chat_lock:
+                    chat_lock.release()
+        finally:
+            if not started:
+                self.waiting -= 1
+
+    async def initialize(self):
+        # created here so the semaphore belongs to the running event loop
+        self._slots = asyncio.Semaphore(self._limit)
+
+    async def shutdown(self):
+        pass
+
+    def stats(self):
+        """
+        Returns the state of the update processing.
+
+        Returns:
+            dict: The number of waiting, processing and processed updates and of busy chats.
+        """
+        return {
+            "max_concurrent_updates": self._limit,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "processing": self.processing,
+            "processed": self.processed,
+            "busy_chats": len(self._chat_locks),
+        }
@@ -0,0 +1,194 @@
+import asyncio
+import contextlib
+import hmac
+import logging
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+from telegram import Update
+
+
+logger = logging.getLogger(__name__)
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# set on the updates forwarded by another replica, they are never forwarded again
+FORWARDED_HEADER = "X-Bot-Forwarded"
+
+
+def get_partition(update, partitions):
+    """
+    Get the partition of an update, all the updates of a chat belong to the same partition.
+    The updates without a chat, like inline queries, are partitioned by their user, whose
+    private chat has the same id, so they belong to the partition of that chat.
+
+    Args:
+        update (telegram.Update): The update.
+        partitions (int): The number of partitions.
+
+    Returns:
+        int: The partition of the update.
+    """
+    if update.effective_chat:
+        key = update.effective_chat.id
+    elif update.effective_user:
+        key = update.effective_user.id
+    else:
+        key = update.update_id
+    return key % partitions
+
+
+def create_webhook_app(application, path="/telegram", secret_token=None, replica_urls=None, replica_index=0):
+    """
+    Create the ASGI app which receives the updates of the bot.
+
+    With several replicas behind a load balancer, every replica owns a partition of the chats,
+    see get_partition, and forwards the updates of the other chats to their replica. So the
+    updates of a chat are processed in order by one process, which also keeps its in-process
+    caches and pending inline queries.
+
+    Args:
+        application (telegram.ext.Application): The bot application.
+        path (str, optional): The path Telegram posts the updates to. Defaults to "/telegram".
+        secret_token (str, optional): The secret token Telegram sends in every request,
+            requests without it are rejected. Defaults to None.
+        replica_urls (list, optional): The base urls of all the replicas, in the same order on
+            every replica. Defaults to None, a single replica.
+        replica_index (int, optional): The index of this replica in replica_urls. Defaults to 0.
+
+    Returns:
+        starlette.applications.Starlette: The ASGI app.
+    """
+
+    http = {}
+
+    @contextlib.asynccontextmanager
+    async def lifespan(_):
+        async with httpx.AsyncClient(timeout=10) as client:
+            http["client"] = client
+            yield
+
+    async def forward(update, data, partition) -> bool:
+        headers = {FORWARDED_HEADER: "1"}
+        if secret_token:
+            headers[SECRET_TOKEN_HEADER] = secret_token
+        try:
+            response = await http["client"].post(replica_urls[partition].rstrip("/") + path,
+                                                  json=data,
+                                                  headers=headers)
+            response.raise_for_status()
+        except httpx.HTTPError as error:
+            logger.warning("Could not forward update %s to replica %s: %r", update.update_id, partition, error)
+            return False
+        return True
+
+    async def telegram(request: Request) -> Response:
+        if secret_token:
+            header = request.headers.get(SECRET_TOKEN_HEADER, "")
+            if not hmac.compare_digest(header.encode(), secret_token.encode()):
+                return Response(status_code=403)
+
+        try:
+            data = await request.json()
+            update = Update.de_json(data, application.bot) if isinstance(data, dict) else None
+        except (ValueError, TypeError, KeyError):
+            update = None
+        if update is None:
+            return Response(status_code=400)
+
+        if replica_urls and FORWARDED_HEADER not in request.headers:
+            partition = get_partition(update, len(replica_urls))
+            # the update is processed here if its replica can not be reached
+            if partition != replica_index and await forward(update, data, partition):
+                return Response()
+
+        await application.update_queue.put(update)
+        return Response()
+
+    return Starlette(routes=[
+        Route(path, telegram, methods=["POST"]),
+    ], lifespan=lifespan)
+
+
+def create_health_app(application):
+    """
+    Create the ASGI app which reports the health of the bot at /healthz. It is served on
+    its own local listener, see run_webhook, not on the public webhook listener.
+
+    Args:
+        application (telegram.ext.Application): The bot application.
+
+    Returns:
+        starlette.applications.Starlette: The ASGI app.
+    """
+
+    async def health(_: Request) -> Response:
+        if not application.running:
+            return PlainTextResponse("stopped", status_code=503)
+        return JSONResponse({"status": "ok", "update_queue": application.update_queue.qsize()})
+
+    return Starlette(routes=[
+        Route("/healthz", health, methods=["GET"]),
+    ])
+
+
+async def run_webhook(application, url, secret_token, listen="0.0.0.0", port=8443, path="/telegram",
+                      replica_urls=None, replica_index=0, health_listen="127.0.0.1", health_port=8080):
+    """
+    Run the bot with a webhook instead of polling, until the server is stopped.
+
+    Args:
+        application (telegram.ext.Application): The bot application.
+        url (str): The public base url of the server, which Telegram posts the updates to.
+        listen (str, optional): The address the server listens on. Defaults to "0.0.0.0".
+        port (int, optional): The port the server listens on. Defaults to 8443.
+        path (str, optional): The path of the webhook. Defaults to "/telegram".
+        secret_token (str): The secret token of the webhook, Telegram sends it in every request.
+        replica_urls (list, optional): The base urls of all the replicas. Defaults to None.
+        replica_index (int, optional): The index of this replica in replica_urls. Defaults to 0.
+        health_listen (str, optional): The address of the health listener. Defaults to "127.0.0.1".
+        health_port (int, optional): The port of the health listener. Defaults to 8080.
+
+    Raises:
+        ValueError: If the secret token is missing, anyone could send updates to the webhook.
+    """
+    if not secret_token:
+        raise ValueError("WEBHOOK_SECRET_TOKEN is required in webhook mode")
+
+    server = uvicorn.Server(uvicorn.Config(
+        app=create_webhook_app(application, path, secret_token, replica_urls, replica_index),
+        host=listen,
+        port=port,
+        use_colors=False,
+    ))
+    health_server = uvicorn.Server(uvicorn.Config(
+        app=create_health_app(application),
+        host=health_listen,
+        port=health_port,
+        use_colors=False,
+        log_level="warning",
+    ))
+    # the signals stop the webhook server, which stops the health server
+    health_server.install_signal_handlers = lambda: None
+
+    # run_polling calls post_init and post_shutdown itself, here they are called by hand
+    try:
+        async with application:
+            if application.post_init:
+                await application.post_init(application)
+            await application.bot.set_webhook(url=url.rstrip("/") + path,
+                                              secret_token=secret_token,
+                                              allowed_updates=Update.ALL_TYPES)
+            await application.start()
+            logger.info("Listening for webhook updates on %s:%s%s", listen, port, path)
+            health = asyncio.ensure_future(health_server.serve())
+            try:
+                await server.serve()
+            finally:
+                health_server.should_exit = True
+                await health
+                await application.stop()
+    finally:
+        if application.post_shutdown:
+            await application.post_shutdown(application)